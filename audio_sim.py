@@ -0,0 +1,105 @@
+# audio_sim.py
+# 描述: 在电脑上估算 buzzer_player.py 两种定时器调度方式播放现有乐曲时的中断次数和音符起始误差:
+#       SCHED_PERIODIC (固定频率中断) 与 SCHED_ONESHOT (只在下一个音符/包络事件时触发)。
+#       输入为 txttomsc.py 输出的乐曲目录 (每首一个子目录，含 metadata.txt, 0.msc, 1.msc)，
+#       也可以直接给出单首乐曲的目录。下面的常量须与 buzzer_player.py 保持一致。
+#       定时器取整与设备相同: 固定频率模式用整数 freq (周期 1000000/freq)；一次性定时器以
+#       tick_hz=1000000 直接按微秒设周期，没有取整误差。
+import os
+import sys
+import math
+import struct
+import argparse
+
+NOTE_FORMAT = '<HHBB'
+NOTE_SIZE = struct.calcsize(NOTE_FORMAT)
+ENV_DUTY_STEP = 8
+ENV_MIN_US = 4000
+ONESHOT_MIN_US = 500
+ONESHOT_MAX_US = 50000
+
+def read_song(song_dir):
+    """返回 (bpm, [声道0音符, 声道1音符])，音符为 (起始 us, 时长 us, 包络更新间隔 us)。"""
+    with open(os.path.join(song_dir, 'metadata.txt'), 'r', encoding='utf-8') as f:
+        bpm = float(f.readline().split(':')[1].strip())
+    tick_us = int(60.0 * 1000000 / bpm / 16.0)
+    tracks = []
+    for track_id in range(2):
+        notes = []
+        with open(os.path.join(song_dir, f'{track_id}.msc'), 'rb') as f: data = f.read()
+        for o in range(0, len(data) - NOTE_SIZE + 1, NOTE_SIZE):
+            start_64th, end_64th, _, loudness = struct.unpack_from(NOTE_FORMAT, data, o)
+            if start_64th == 0 and end_64th == 0: break
+            duration_us = (end_64th - start_64th) * tick_us
+            slope = (loudness << 16) // duration_us if duration_us > 0 else 0
+            step = max(ENV_MIN_US, (ENV_DUTY_STEP << 16) // slope) if slope else duration_us
+            notes.append((start_64th * tick_us, duration_us, step))
+        tracks.append(notes)
+    return bpm, tracks
+
+def simulate_periodic(bpm, tracks, precision, latency_us):
+    """返回 (中断次数, 起始误差列表)。播放器在最后一个音符开始后停止。"""
+    freq_hz = max(20, min(500, int(bpm / 60.0 * 16 * precision)))
+    period_us = 1000000 / freq_hz # 定时器按整数频率产生周期
+    end_us = max((notes[-1][0] for notes in tracks if notes), default=0)
+    errors = [math.ceil(start / period_us) * period_us - start + latency_us for notes in tracks for start, _, _ in notes]
+    return int(end_us // period_us) + 1, errors
+
+def simulate_oneshot(tracks, latency_us):
+    """按 buzzer_player._track_tick 的规则逐次中断推进，返回 (中断次数, 起始误差列表)。"""
+    idx = [0] * len(tracks)
+    current = [None] * len(tracks) # (起始, 时长, 包络间隔)
+    now, interrupts, errors = ONESHOT_MIN_US + latency_us, 0, []
+    while True:
+        interrupts += 1
+        delay = None
+        for t, notes in enumerate(tracks):
+            while idx[t] < len(notes) and notes[idx[t]][0] <= now:
+                errors.append(now - notes[idx[t]][0])
+                current[t] = notes[idx[t]]; idx[t] += 1
+            candidates = []
+            if idx[t] < len(notes): candidates.append(notes[idx[t]][0] - now)
+            if current[t]:
+                start, duration, step = current[t]
+                left = start + duration - now
+                if left > 0: candidates.append(min(step, left))
+                else: current[t] = None
+            if candidates: delay = min(candidates) if delay is None else min(delay, *candidates)
+        if all(idx[t] >= len(notes) for t, notes in enumerate(tracks)): break
+        delay = max(ONESHOT_MIN_US, min(ONESHOT_MAX_US, delay if delay is not None else ONESHOT_MAX_US))
+        now += delay + latency_us # 周期按微秒直接设定，不经频率换算
+    return interrupts, errors
+
+def song_dirs(path):
+    if os.path.exists(os.path.join(path, 'metadata.txt')): return [path]
+    return sorted(os.path.join(path, d) for d in os.listdir(path) if os.path.exists(os.path.join(path, d, 'metadata.txt')))
+
+def main():
+    parser = argparse.ArgumentParser(description="估算两种音频定时器调度方式的中断次数和音符起始误差。")
+    parser.add_argument("bgm_dir", help="乐曲目录 (含多个乐曲子目录) 或单首乐曲目录。")
+    parser.add_argument("--precision", type=int, default=4, help="固定频率模式的精度参数 (与 play() 相同，默认 4)。")
+    parser.add_argument("--latency-us", type=int, default=50, help="假定的中断响应延迟 (默认 50 us)。")
+    args = parser.parse_args()
+
+    dirs = song_dirs(args.bgm_dir)
+    if not dirs:
+        print(f"致命错误: '{args.bgm_dir}' 下没有找到乐曲。"); sys.exit(1)
+    print(f"{'乐曲':<12} {'音符':>6} | {'固定频率 中断':>12} {'平均误差':>8} {'最大误差':>8} | {'一次性 中断':>10} {'平均误差':>8} {'最大误差':>8}")
+    totals = [0, 0, 0]
+    for song_dir in dirs:
+        try:
+            bpm, tracks = read_song(song_dir)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"跳过 '{song_dir}': {e}"); continue
+        count = sum(len(notes) for notes in tracks)
+        if not count: continue
+        p_irq, p_err = simulate_periodic(bpm, tracks, args.precision, args.latency_us)
+        o_irq, o_err = simulate_oneshot(tracks, args.latency_us)
+        totals[0] += count; totals[1] += p_irq; totals[2] += o_irq
+        print(f"{os.path.basename(song_dir):<12} {count:>6} | {p_irq:>12} {sum(p_err) / count:>7.0f}us {max(p_err):>7.0f}us |"
+              f" {o_irq:>10} {sum(o_err) / count:>7.0f}us {max(o_err):>7.0f}us")
+    if totals[1]:
+        print(f"合计 {totals[0]} 个音符: 固定频率 {totals[1]} 次中断，一次性定时器 {totals[2]} 次 ({totals[2] * 100 // totals[1]}%)。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# bench_crc32.py
+# 描述: ucrc32 各实现的正确性校验与吞吐量测试。可在设备上运行 (import bench_crc32; bench_crc32.run())，
+#       也可在电脑上运行 (python bench_crc32.py，此时额外与 zlib.crc32 对照)。
+import time
+import ucrc32
+
+SIZES = (64, 1024, 4096)
+ITERATIONS = 8
+
+def _ticks_us():
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return int(time.perf_counter() * 1000000)
+
+def _elapsed_us(start):
+    try:
+        return time.ticks_diff(time.ticks_us(), start)
+    except AttributeError:
+        return int(time.perf_counter() * 1000000) - start
+
+def _implementations():
+    impls = [('bitwise', ucrc32.crc32_bitwise), ('table', ucrc32.crc32_table)]
+    if ucrc32.crc32_viper: impls.append(('viper', ucrc32.crc32_viper))
+    if ucrc32.crc32_native: impls.append(('binascii', ucrc32.crc32_native))
+    return impls
+
+def verify(impls):
+    """所有实现 (及电脑上的 zlib) 在各种长度、续算初值下结果必须一致。"""
+    try:
+        import zlib
+        reference = zlib.crc32
+    except ImportError:
+        reference = ucrc32.crc32_bitwise
+    samples = [b'', b'a', b'123456789', bytes(range(256)), bytearray(b'\xff' * 300)]
+    for data in samples:
+        for seed in (0, 0x12345678):
+            expected = reference(data, seed)
+            for name, fn in impls:
+                got = fn(data, seed)
+                if got != expected:
+                    print(f"校验失败: {name} 长度 {len(data)} 初值 {seed:#x}: {got:#010x} != {expected:#010x}")
+                    return False
+    return True
+
+def run():
+    impls = _implementations()
+    print(f"ucrc32 当前实现: {ucrc32.IMPLEMENTATION}")
+    if not verify(impls): return
+    print("正确性校验通过。")
+    for size in SIZES:
+        data = bytes((i * 31 + 7) & 0xFF for i in range(size))
+        for name, fn in impls:
+            # 逐位实现太慢，大块数据只跑一次
+            iterations = 1 if name == 'bitwise' and size > 1024 else ITERATIONS
+            start = _ticks_us()
+            for _ in range(iterations):
+                fn(data)
+            elapsed = max(1, _elapsed_us(start))
+            print(f"  {size:>5} 字节  {name:<8} {elapsed // iterations:>9} us/次  {size * iterations * 1000000 // elapsed // 1024:>7} KB/s")
+
+if __name__ == "__main__":
+    run()
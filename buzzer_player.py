@@ -1,215 +1,613 @@
-# buzzer_player.py (V8.1 - Fixed Initialization Deadlock)
+# buzzer_player.py (V9.5 - Refill Thread)
+# 描述: 双声道蜂鸣器 BGM/SFX 播放器。
+#   .msc 音符 (6 字节 '<HHBB': 起始/结束 64 分音符时刻, 音高, 响度) 在主循环的 poll() 中
+#   预先解码为 array('I') 音符表，每个音符 _NOTE_FIELDS 个字段 (起始 us, 时长 us, 频率, 响度, 衰减斜率)。
+#   定时器中断只做整数比较: 到点的音符切换为当前音符，按斜率计算包络占空比，
+#   频率或占空比确实变化时才写 PWM。中断内不分配内存，每次中断只读取一次 ticks_us。
+#   每个声道的音符表分为两半 (双缓冲)，状态字 _ST_COUNT0/_ST_COUNT1 为该半区的音符数，
+#   0 表示空: 中断用完一半后清零，poll() 填好另一半后最后写入音符数，以此完成交接。
+#   两种调度方式:
+#     SCHED_PERIODIC: 按 bpm/60*16*precision Hz (20~500) 的固定频率中断，音符起始被量化到中断周期。
+#     SCHED_ONESHOT : 每次中断算出两个声道下一个事件 (音符开始、音符结束、包络下降一级) 的时刻，
+#                     只在那时触发一次性定时器；稀疏段落中断少，音符起始误差只剩中断延迟。
+#   两种方式都统计音符起始的延迟 (实际中断时刻 - 应开始时刻)，用 isr_stats() 读出对比，
+#   电脑上可用 audio_sim.py 对现有乐曲估算两种方式的中断次数和起始误差。
+#   循环播放不再停止重开: 文件读到末尾时 poll() 把文件指针移回循环起点，并给该声道的时间基准
+#   加上一个循环周期继续解码，两个半区始终是满的。metadata.txt 可选一行 "LOOP: <64 分音符时刻>"
+#   指定循环起点 (默认 0)，循环终点为两个声道中最晚结束的音符。播放时间超过 _REBASE_US 后，
+#   poll() 在关中断的几微秒内把时间原点、音符表和时间基准整体前移一个周期，避免 ticks 差值溢出。
+#   切歌: 每首乐曲的文件句柄、音符表和声道状态放在一个 _Deck 里，共两个。cue() 在空闲时打开下一首，
+#   之后的 poll() 分次完成循环扫描、填好缓冲区，play() 只交换两个 deck 的引用，可选先淡出。
+#   交换只改引用和标志；固定频率定时器按新乐曲的频率重设放在中断之外 (play() 或淡出后的 poll())。
+#   缓冲深度 buffer_notes (每个半区的音符数) 可配置。正在播放的半区剩余音符少于 low_water 而另一半
+#   还没填好时，中断置起补充请求，refill_pending() 为真；主循环之外的耗时操作 (如脚本批量执行)
+#   可以据此顺手调用 poll()。stats() 给出欠载次数 (中断发现当前半区已空而文件未读完)、
+#   最长补充延迟 (半区变空到被填好) 和定时器抖动 (实际中断间隔与预期之差)，用来权衡内存与播放连续性。
+#   start_refill_thread() 可选地用 _thread 起一个补充线程代替主循环的 poll()，音频不再受界面代码快慢影响。
+#   线程与中断之间不加锁，仍靠半区音符数交接；线程与主循环之间用一把锁保护 deck 的装载、交换和关闭
+#   (中断从不拿这把锁)。单核芯片上线程靠 GIL 轮转运行，主循环的长时间 C 调用 (如屏幕刷新) 期间仍要等待。
 import machine
 import time
-import gc
-import struct
+import micropython
+from array import array
 from micropython import const
+try:
+    import _thread
+except ImportError:
+    _thread = None
 
-# --- 配置 和 Buzzer 类 (与 V8.0 相同，保持不变) ---
-_BUFFER_SIZE = const(64) 
+_BUFFER_NOTES = const(64) # 默认每个半区的音符数
+_LOW_WATER = const(16)    # 默认补充请求水位
 _NOTE_BYTE_SIZE = const(6)
 FREQ_LUT = (33,35,37,39,41,44,46,49,52,55,58,62,65,69,73,78,82,87,92,98,104,110,117,123,131,139,147,156,165,175,185,196,208,220,233,247,262,277,294,311,330,349,370,392,415,440,466,494,523,554,587,622,659,698,740,784,831,880,932,988,1047,1109,1175,1245,1319,1397,1480,1568,1661,1760,1865,1976,2093,2217,2349,2489,2637,2794,2960,3136,3322,3520,3729,3951,4186)
 MIDI_LUT_OFFSET = const(24)
 _MODE_BGM = const(0)
 _MODE_SFX = const(1)
+_SFX_LOUDNESS = const(200)
+_SFX_MAX_NOTES = const(8)
+SCHED_PERIODIC = const(0)
+SCHED_ONESHOT = const(1)
+_ENV_DUTY_STEP = const(8)       # 一次性定时器模式下，包络每下降这么多占空比才更新一次
+_ENV_MIN_US = const(4000)       # 包络更新的最短间隔
+_ONESHOT_MIN_US = const(500)    # 一次性定时器的最短/最长间隔；最长间隔保证乐曲结束能被及时发现
+_ONESHOT_MAX_US = const(50000)
+_IDLE_US = const(0x3FFFFFFF)    # 没有后续事件
+_REBASE_US = const(1 << 27)     # 循环播放超过约 134 秒后前移时间原点 (ticks_diff 只能表示 ±2^29 us)
+_CUE_SCAN_BLOCKS = const(4)     # cue() 之后每次 poll() 最多为循环扫描读取的块数 (每块 buffer_notes 个音符)
 
-def _calculate_duty_viper(duration_us: int, us_since_start: int, loudness: int) -> int:
-    if us_since_start >= duration_us: return -1
-    remaining_us = duration_us - us_since_start
-    return (loudness * remaining_us) // duration_us
+# --- 音符表字段 ---
+_NF_START = const(0)  # 起始时刻 (us，相对乐曲/音效的时间原点)
+_NF_DUR = const(1)    # 时长 (us)
+_NF_FREQ = const(2)   # 频率 (Hz)，0 为休止
+_NF_LOUD = const(3)   # 响度 (起始占空比)
+_NF_SLOPE = const(4)  # 衰减斜率: 每微秒下降的占空比 << 16，中断里用乘法和移位代替除法
+_NF_STEP = const(5)   # 包络更新间隔 (us)，一次性定时器模式使用
+_NOTE_FIELDS = const(6)
+
+# --- 缓冲遥测 (array('I')) ---
+_TM_UNDERRUNS = const(0)    # 欠载次数
+_TM_REFILLS = const(1)      # 完成的半区补充次数
+_TM_MAX_REFILL = const(2)   # 最长补充延迟 (us)
+_TM_MAX_JITTER = const(3)   # 最大定时器抖动 (us)
+_TM_LAST_TICK = const(4)    # 上一次中断的 ticks_us
+_TM_EMPTY0 = const(5)       # 声道 0/1 的非活动半区变空的时刻 (ticks_us | 1)，0 表示已填好
+_TM_STARVING0 = const(7)    # 声道 0/1 正处于欠载中，避免同一次欠载重复计数
+_TM_SIZE = const(9)
+
+# --- 声道状态字 (array('I')) ---
+_ST_ACTIVE = const(0)     # 正在播放的半区
+_ST_IDX = const(1)        # 半区内下一个音符
+_ST_COUNT0 = const(2)     # 0 号半区音符数，0 为空
+_ST_COUNT1 = const(3)     # 1 号半区音符数
+_ST_NOTE_START = const(4) # 当前音符
+_ST_NOTE_DUR = const(5)   # 当前音符时长，0 表示没有正在发声的音符
+_ST_FREQ = const(6)
+_ST_LOUD = const(7)
+_ST_SLOPE = const(8)
+_ST_DUTY = const(9)       # 本次中断算出的占空比
+_ST_STEP = const(10)
+_ST_ONSETS = const(11)    # 已开始的音符数
+_ST_LATE_SUM = const(12)  # 音符起始延迟累计 (us)
+_ST_LATE_MAX = const(13)  # 音符起始最大延迟 (us)
+_ST_SIZE = const(14)
+
+@micropython.viper
+def _track_tick(notes, state, now: int, half_size: int) -> int:
+    """
+    推进一个声道到 now (us)：切换到最后一个已到点的音符，并算出当前包络占空比。
+    返回距离该声道下一个事件的微秒数，没有后续事件时返回 _IDLE_US。
+    """
+    t = ptr32(notes); s = ptr32(state)
+    active = int(s[_ST_ACTIVE])
+    count = int(s[_ST_COUNT0 + active])
+    if count == 0 and int(s[_ST_COUNT1 - active]) > 0:
+        # 欠载后 poll() 填的是另一半，从那一半接着播
+        active = 1 - active; s[_ST_ACTIVE] = active; s[_ST_IDX] = 0
+        count = int(s[_ST_COUNT0 + active])
+    next_us = _IDLE_US
+    while count > 0:
+        i = int(s[_ST_IDX])
+        base = (active * half_size + i) * _NOTE_FIELDS
+        late = now - int(t[base + _NF_START])
+        if late < 0:
+            next_us = -late; break
+        s[_ST_ONSETS] = int(s[_ST_ONSETS]) + 1; s[_ST_LATE_SUM] = int(s[_ST_LATE_SUM]) + late
+        if late > int(s[_ST_LATE_MAX]): s[_ST_LATE_MAX] = late
+        s[_ST_NOTE_START] = t[base + _NF_START]; s[_ST_NOTE_DUR] = t[base + _NF_DUR]
+        s[_ST_FREQ] = t[base + _NF_FREQ]; s[_ST_LOUD] = t[base + _NF_LOUD]; s[_ST_SLOPE] = t[base + _NF_SLOPE]
+        s[_ST_STEP] = t[base + _NF_STEP]
+        i += 1
+        if i >= count:
+            s[_ST_COUNT0 + active] = 0 # 交还给 poll() 填充
+            active = 1 - active; s[_ST_ACTIVE] = active; i = 0
+            count = int(s[_ST_COUNT0 + active])
+        s[_ST_IDX] = i
+    duty = 0
+    dur = int(s[_ST_NOTE_DUR])
+    if dur > 0 and int(s[_ST_FREQ]) > 0:
+        elapsed = now - int(s[_ST_NOTE_START])
+        if elapsed < dur:
+            duty = int(s[_ST_LOUD]) - ((elapsed * int(s[_ST_SLOPE])) >> 16)
+            step = int(s[_ST_STEP])
+            if dur - elapsed < step: step = dur - elapsed
+            if step < next_us: next_us = step
+        else: s[_ST_NOTE_DUR] = 0
+    if duty < 0: duty = 0
+    s[_ST_DUTY] = duty
+    return next_us
+
+@micropython.viper
+def _shift_times(notes, length: int, state, delta: int):
+    """把音符表里所有起始时刻和当前音符的起始时刻前移 delta us。"""
+    t = ptr32(notes); s = ptr32(state)
+    i = _NF_START
+    while i < length:
+        v = int(t[i]) - delta
+        if v < 0: v = 0 # 早已到点的旧音符，保持"已到点"即可
+        t[i] = v; i += _NOTE_FIELDS
+    v = int(s[_ST_NOTE_START]) - delta
+    if v < 0: v = 0
+    s[_ST_NOTE_START] = v
+
+def _set_note(notes, base, start_us, duration_us, freq, loudness):
+    notes[base + _NF_START] = start_us
+    notes[base + _NF_DUR] = duration_us
+    notes[base + _NF_FREQ] = freq
+    notes[base + _NF_LOUD] = loudness
+    slope = (loudness << 16) // duration_us if duration_us > 0 else 0
+    notes[base + _NF_SLOPE] = slope
+    notes[base + _NF_STEP] = max(_ENV_MIN_US, (_ENV_DUTY_STEP << 16) // slope) if slope else duration_us
+
+def _clear_state(state):
+    for i in range(_ST_ONSETS): state[i] = 0 # 起始延迟统计跨乐曲累计，由 reset_isr_stats() 清零
 
 class Buzzer:
-    __slots__ = ('pwm', '_note_loudness', '_note_start_us', '_note_duration_us', '_current_freq')
+    """一个 PWM 声道，只在频率或占空比变化时才写寄存器。"""
+    __slots__ = ('pwm', 'freq', 'duty', 'writes')
     def __init__(self, pin_id: int):
         self.pwm = machine.PWM(machine.Pin(pin_id), freq=440, duty=0)
-        self._current_freq = 0
-        self._note_loudness = 0
-        self._note_start_us = 0
-        self._note_duration_us = 0
-    def start_note(self, freq: int, loudness: int, duration_us: int):
-        self._note_start_us = time.ticks_us()
-        self._note_duration_us = duration_us
-        self._note_loudness = loudness
-        #print(freq,loudness,duration_us)
-        if freq > 0:
-            if freq != self._current_freq:
-                self.pwm.freq(freq)
-                self._current_freq = freq
-        else: self.pwm.duty(0)
+        self.freq = 440
+        self.duty = 0
+        self.writes = 0 # PWM 写入次数
+    def write(self, freq: int, duty: int):
+        if freq and freq != self.freq:
+            self.pwm.freq(freq); self.freq = freq; self.writes += 1
+        if duty != self.duty:
+            self.pwm.duty(duty); self.duty = duty; self.writes += 1
     def stop(self):
-        self._note_duration_us = 0; self.pwm.duty(0)
-    def update_pwm(self):
-        if self._note_duration_us == 0: return
-        us_since_start = time.ticks_diff(time.ticks_us(), self._note_start_us)
-        duty = _calculate_duty_viper(self._note_duration_us, us_since_start, self._note_loudness)
-        if duty == -1: self.stop()
-        else: self.pwm.duty(duty)
+        self.duty = 0; self.pwm.duty(0)
+
+class _NoLock:
+    """没有补充线程时代替锁，使 with self._io_lock 在两种情况下写法一致。"""
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+
+class _Deck:
+    """
+    一首乐曲的播放现场: 文件句柄、解码后的音符表 (双缓冲) 和声道状态。
+    SongPlayer 有两个 deck，一个正在播放，另一个可以用 cue() 提前装好下一首；切歌只是交换两个引用。
+    """
+    __slots__ = ('info', 'pending', 'files', 'half', 'notes', 'state', 'fully_read', 'tick_us', 'timer_hz',
+                 'time_base_us', 'loop', 'loop_offset', 'loop_start_us', 'loop_period_us', '_scan')
+    def __init__(self, half: int):
+        self.info = None # (music_name, loop, precision)，None 表示空
+        self.pending = None # 已打开、还在装载中的乐曲 (见 begin()/step())
+        self.files = [None, None]
+        self.half = half # 每个半区的音符数
+        self.notes = (array('I', [0] * (2 * half * _NOTE_FIELDS)), array('I', [0] * (2 * half * _NOTE_FIELDS)))
+        self.state = (array('I', [0] * _ST_SIZE), array('I', [0] * _ST_SIZE))
+        self.fully_read = [False, False]
+        self.tick_us = 0 # 64 分音符时长
+        self.timer_hz = 100 # 固定频率模式下的中断频率
+        self.time_base_us = [0, 0] # 每个声道已循环的总时长，解码时加到音符起始时刻上
+        self.loop = False
+        self.loop_offset = [0, 0] # 循环起点音符在 .msc 中的字节偏移
+        self.loop_start_us = 0
+        self.loop_period_us = 0 # 0 表示不能循环 (乐曲为空或 LOOP 超过终点)
+        self._scan = None # 循环扫描进度 [声道, 读取位置, 循环起点偏移, 最晚结束时刻, 循环起点时刻]
+
+    def close(self):
+        for i, f in enumerate(self.files):
+            if f: f.close(); self.files[i] = None
+        self.info = self.pending = self._scan = None
+
+    def begin(self, opener, song_info):
+        """打开乐曲、读取 metadata.txt；循环扫描和填充缓冲区留给 step()。失败时返回 False。"""
+        self.close()
+        self.fully_read[0] = self.fully_read[1] = False
+        self.time_base_us[0] = self.time_base_us[1] = 0
+        self.loop_period_us = 0
+        for state in self.state: _clear_state(state)
+        music_name, self.loop, precision = song_info
+        song_dir = f"/bgm/{music_name}"
+        try:
+            bpm, loop_64th = None, 0
+            with opener(f"{song_dir}/metadata.txt", "r") as f:
+                while True: # 资源包的 PackFile 不支持迭代，逐行 readline
+                    line = f.readline()
+                    if not line: break
+                    key, _, value = line.partition(':')
+                    key = key.strip().upper()
+                    if key == 'BPM': bpm = float(value.strip())
+                    elif key == 'LOOP': loop_64th = int(value.strip())
+            if bpm is None: raise ValueError("metadata.txt 缺少 BPM")
+            self.tick_us = int(60.0 * 1000000 / bpm / 16.0)
+            self.timer_hz = max(20, min(500, int(bpm / 60.0 * 16 * precision)))
+            self.files[0] = opener(f"{song_dir}/0.msc", "rb")
+            self.files[1] = opener(f"{song_dir}/1.msc", "rb")
+            if self.loop: self._scan = [0, 0, -1, 0, loop_64th]
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法加载 '{music_name}': {e}")
+            self.close(); return False
+        self.pending = song_info
+        return True
+
+    def step(self, raw, blocks: int) -> bool:
+        """继续装载 begin() 打开的乐曲: 循环扫描最多读取 blocks 块 (负数不限)，扫描完成后填满缓冲区。装好时返回 True。"""
+        if self._scan and not self._scan_loop(raw, blocks): return False
+        for track_id in range(2):
+            self.fill(track_id, 0, raw)
+            self.fill(track_id, 1, raw)
+        self.info, self.pending = self.pending, None
+        return True
+
+    def fill(self, track_id: int, buffer_to_fill_idx: int, raw):
+        """读取一个半区的 .msc 音符并解码到音符表，最后写入音符数完成交接。返回填入的音符数。"""
+        state = self.state[track_id]
+        if self.fully_read[track_id] or state[_ST_COUNT0 + buffer_to_fill_idx]:
+            return 0 # 如果文件已读完，或此半区还没播完，则不操作
+
+        f = self.files[track_id]
+        notes = self.notes[track_id]
+        half = self.half
+        base = buffer_to_fill_idx * half * _NOTE_FIELDS
+        tick_us = self.tick_us
+        looping = self.loop and self.loop_period_us
+        count, wrapped = 0, False
+        while count < half:
+            time_base = self.time_base_us[track_id]
+            bytes_read = f.readinto(memoryview(raw)[:(half - count) * _NOTE_BYTE_SIZE])
+            got = 0
+            for o in range(0, bytes_read - _NOTE_BYTE_SIZE + 1, _NOTE_BYTE_SIZE):
+                start_64th = raw[o] | (raw[o + 1] << 8)
+                end_64th = raw[o + 2] | (raw[o + 3] << 8)
+                if start_64th == 0 and end_64th == 0: # 结束标记
+                    bytes_read = 0; break
+                pitch = raw[o + 4] - MIDI_LUT_OFFSET
+                freq = FREQ_LUT[pitch] if 0 <= pitch < len(FREQ_LUT) else 0
+                _set_note(notes, base, time_base + start_64th * tick_us, (end_64th - start_64th) * tick_us, freq, raw[o + 5])
+                base += _NOTE_FIELDS; count += 1; got += 1
+            if count == half: break
+            # 读到文件末尾: 循环时回到循环起点继续填满本半区，否则标记读完
+            if not looping or (wrapped and got == 0): # 循环段内没有音符
+                self.fully_read[track_id] = True; break
+            f.seek(self.loop_offset[track_id])
+            self.time_base_us[track_id] = time_base + self.loop_period_us
+            wrapped = True
+        state[_ST_COUNT0 + buffer_to_fill_idx] = count
+        return count
+
+    def _scan_loop(self, raw, blocks: int) -> bool:
+        """
+        分次找出每个声道循环起点的字节偏移，以及两个声道中最晚的结束时刻，算出循环周期。
+        读满 blocks 块时保存进度返回 False，全部扫描完返回 True。
+        """
+        scan = self._scan
+        loop_64th = scan[4]
+        while scan[0] < 2:
+            track_id = scan[0]
+            f = self.files[track_id]
+            f.seek(0, 2); size = f.tell() - f.tell() % _NOTE_BYTE_SIZE
+            # 读完整个声道: 前面的长音符可能比最后几个音符结束得更晚；结束标记之后的内容不算
+            pos = scan[1]
+            f.seek(pos)
+            while pos < size:
+                if blocks == 0:
+                    scan[1] = pos; return False
+                blocks -= 1
+                n = f.readinto(raw)
+                if n < _NOTE_BYTE_SIZE: break
+                for o in range(0, n - _NOTE_BYTE_SIZE + 1, _NOTE_BYTE_SIZE):
+                    start = raw[o] | (raw[o + 1] << 8); end = raw[o + 2] | (raw[o + 3] << 8)
+                    if start == 0 and end == 0: pos = size; break
+                    if scan[2] < 0 and start >= loop_64th: scan[2] = pos + o
+                    if end > scan[3]: scan[3] = end
+                else: pos += n
+            self.loop_offset[track_id] = scan[2] if scan[2] >= 0 else size # 循环段内没有该声道的音符
+            f.seek(0)
+            scan[0] += 1; scan[1] = 0; scan[2] = -1
+        end_64th = scan[3]
+        self._scan = None
+        self.loop_start_us = loop_64th * self.tick_us
+        self.loop_period_us = (end_64th - loop_64th) * self.tick_us if end_64th > loop_64th else 0
+        if not self.loop_period_us: print("警告: 乐曲无法循环 (没有音符或 LOOP 超过乐曲结尾)。")
+        return True
+
+    def finished(self):
+        """两个声道都已读完且播完。"""
+        if not (self.fully_read[0] and self.fully_read[1]): return False
+        s0 = self.state[0]; s1 = self.state[1]
+        return s0[_ST_COUNT0 + s0[_ST_ACTIVE]] == 0 and s1[_ST_COUNT0 + s1[_ST_ACTIVE]] == 0
 
 class SongPlayer:
-    def __init__(self, pin0: int, pin1: int):
-        self._players = [Buzzer(pin0), Buzzer(pin1)]
+    def __init__(self, pin0: int, pin1: int, opener=open, scheduler=SCHED_PERIODIC, buffer_notes=_BUFFER_NOTES, low_water=_LOW_WATER):
+        self._opener = opener
+        self._scheduler = scheduler
+        self._half = buffer_notes
+        self._low_water = min(low_water, buffer_notes)
+        self._players = (Buzzer(pin0), Buzzer(pin1))
         self._timer = machine.Timer(0)
         self._is_playing_flag = False
-        buffer_byte_size = _BUFFER_SIZE * _NOTE_BYTE_SIZE
-        self._buffers = ((bytearray(buffer_byte_size), bytearray(buffer_byte_size)), (bytearray(buffer_byte_size), bytearray(buffer_byte_size)))
-        self._file_handles = [None, None]
-        self._active_buf_idx = [0, 0]
-        self._note_idx = [0, 0]
-        self._buffer_is_full = [[False, False], [False, False]]
-        self._file_fully_read = [False, False]
-        self._64th_note_duration_us = 0
-        self._loop = False
+        self._raw = bytearray(buffer_notes * _NOTE_BYTE_SIZE) # 读取 .msc 的暂存区，所有 deck 共用
+        self._deck = _Deck(buffer_notes)      # 正在播放
+        self._cue_deck = _Deck(buffer_notes)  # 预先装好的下一首
+        self._retired = None      # 淡出结束后在中断里换下的 deck，由 poll() 关闭文件
+        self._start_time_us = 0
+        self._fade_start_us = 0
+        self._fade_us = 0         # 非 0 表示正在淡出当前 deck，结束时切换到 _cue_deck
         self.last_song_info = None
         self._channel_mode = [_MODE_BGM, _MODE_BGM]
-        self._sfx_queue = [None, None]
+        # 音效也预先转换为音符表 (只用 0 号半区)，时间原点为 play_sfx() 调用时刻
+        self._sfx_notes = (array('I', [0] * (2 * _SFX_MAX_NOTES * _NOTE_FIELDS)), array('I', [0] * (2 * _SFX_MAX_NOTES * _NOTE_FIELDS)))
+        self._sfx_state = (array('I', [0] * _ST_SIZE), array('I', [0] * _ST_SIZE))
+        self._sfx_start_us = [0, 0]
+        # 中断耗时统计: 次数, 累计 us, 最长 us (累计超过 2^30 后在设备上会变成堆上的大整数，长时间采样前先 reset_isr_stats())
+        self._isr_stats = array('I', [0, 0, 0])
+        # 缓冲遥测，下标见 _TM_*
+        self._telemetry = array('I', [0] * _TM_SIZE)
+        self._refill_req = False
+        self._expected_us = 0 # 预期的下一次中断间隔
+        self._timer_reset = True # 刚开始播放或切换了 deck，下一次中断不计抖动
+        self._retime = False     # 中断里完成了淡出切换，固定频率定时器待主循环按新 deck 重新设定
+        self._io_lock = _NoLock() # 补充线程运行时换成真正的锁
+        self._worker = False      # 补充线程是否在运行
+        self._callback = self._timer_callback # 预先绑定，避免每次 init 都创建绑定方法
 
-    # _timer_callback, _process_sfx, _process_bgm 保持不变
     def _timer_callback(self, timer_instance):
         if not self._is_playing_flag: return
-        self._players[0].update_pwm(); self._players[1].update_pwm()
-        current_bgm_us = time.ticks_diff(time.ticks_us(), self._start_time_us)
-        for track_id in range(2):
-            if self._channel_mode[track_id] == _MODE_SFX: self._process_sfx(track_id)
-            else: self._process_bgm(track_id, current_bgm_us)
-        if self._file_fully_read[0] and self._file_fully_read[1]:
-            is_track0_finished = not self._buffer_is_full[0][self._active_buf_idx[0]]
-            is_track1_finished = not self._buffer_is_full[1][self._active_buf_idx[1]]
-            if is_track0_finished and is_track1_finished:
-                if self._loop: self._reset_and_play(self.last_song_info)
-                else: self.stop()
-
-    def _process_sfx(self, track_id):
-        sfx_task = self._sfx_queue[track_id]
-        if not sfx_task: return
-        notes_list, current_note_idx, start_time_ms = sfx_task
-        elapsed_ms = time.ticks_diff(time.ticks_ms(), start_time_ms)
-        total_sfx_duration = sum(note[1] for note in notes_list)
-        if elapsed_ms >= total_sfx_duration:
-            self._sfx_queue[track_id] = None; self._channel_mode[track_id] = _MODE_BGM; return
-        time_cursor, note_to_play_idx = 0, -1
-        for i in range(len(notes_list)):
-            if elapsed_ms >= time_cursor: note_to_play_idx = i
-            time_cursor += notes_list[i][1]
-        if note_to_play_idx != -1 and note_to_play_idx > sfx_task[1]:
-            sfx_task[1] = note_to_play_idx
-            freq, duration_ms = notes_list[note_to_play_idx]
-            self._players[track_id].start_note(freq, 200, duration_ms * 1000)
-
-    def _process_bgm(self, track_id, current_bgm_us):
-        active_buf_index = self._active_buf_idx[track_id]
-        if not self._buffer_is_full[track_id][active_buf_index]: return
-        current_read_buf = self._buffers[track_id][active_buf_index]
-        note_offset = self._note_idx[track_id] * _NOTE_BYTE_SIZE
-        try:
-            start_ts_64th, end_ts_64th, pitch, loudness = struct.unpack_from("<HHBB", current_read_buf, note_offset)
-        except IndexError: return
-        if start_ts_64th == 0 and end_ts_64th == 0:
-            self._buffer_is_full[track_id][active_buf_index] = False; return
-        start_us = start_ts_64th * self._64th_note_duration_us
-        if current_bgm_us >= start_us:
-            duration_us = (end_ts_64th - start_ts_64th) * self._64th_note_duration_us
-            freq = 0
-            if pitch >= MIDI_LUT_OFFSET:
-                lut_index = pitch - MIDI_LUT_OFFSET
-                if lut_index < len(FREQ_LUT): freq = FREQ_LUT[lut_index]
-            #print(track_id)
-            self._players[track_id].start_note(freq, loudness, duration_us)
-            self._note_idx[track_id] += 1
-            if self._note_idx[track_id] == _BUFFER_SIZE:
-                self._buffer_is_full[track_id][active_buf_index] = False
-                self._active_buf_idx[track_id] = 1 - active_buf_index
-                self._note_idx[track_id] = 0
-
-    # --- 核心修正：修改 _fill_buffer 和 _reset_and_play ---
-    
-    def _fill_buffer(self, track_id: int, buffer_to_fill_idx: int):
+        t0 = time.ticks_us()
+        tm = self._telemetry
+        if self._timer_reset: self._timer_reset = False
+        else:
+            jitter = abs(time.ticks_diff(t0, tm[_TM_LAST_TICK]) - self._expected_us)
+            if jitter > tm[_TM_MAX_JITTER]: tm[_TM_MAX_JITTER] = jitter
+        tm[_TM_LAST_TICK] = t0
+        gain = 256
+        if self._fade_us:
+            left = self._fade_us - time.ticks_diff(t0, self._fade_start_us)
+            if left <= 0: self._swap_decks(t0)
+            else: gain = (left << 8) // self._fade_us
+        deck = self._deck
+        now = time.ticks_diff(t0, self._start_time_us)
+        delay = _IDLE_US
+        for track_id in (0, 1):
+            state = deck.state[track_id]
+            d = _track_tick(deck.notes[track_id], state, now, self._half) # BGM 在音效期间也照常推进
+            if d < delay: delay = d
+            if not deck.fully_read[track_id]:
+                active = state[_ST_ACTIVE]
+                if state[_ST_COUNT0 + active] == 0:
+                    if not tm[_TM_STARVING0 + track_id]:
+                        tm[_TM_UNDERRUNS] += 1; tm[_TM_STARVING0 + track_id] = 1
+                else: tm[_TM_STARVING0 + track_id] = 0
+                if state[_ST_COUNT1 - active] == 0:
+                    if not tm[_TM_EMPTY0 + track_id]: tm[_TM_EMPTY0 + track_id] = t0 | 1
+                    if state[_ST_COUNT0 + active] - state[_ST_IDX] < self._low_water: self._refill_req = True
+            duty = (state[_ST_DUTY] * gain) >> 8
+            if self._channel_mode[track_id] == _MODE_SFX:
+                state = self._sfx_state[track_id]
+                d = _track_tick(self._sfx_notes[track_id], state, time.ticks_diff(t0, self._sfx_start_us[track_id]), _SFX_MAX_NOTES)
+                if d < delay: delay = d
+                if state[_ST_COUNT0] == 0 and state[_ST_NOTE_DUR] == 0: self._channel_mode[track_id] = _MODE_BGM
+                duty = state[_ST_DUTY]
+            self._players[track_id].write(state[_ST_FREQ], duty)
+        if self._scheduler == SCHED_ONESHOT: self._arm(delay)
+        stats = self._isr_stats
+        elapsed = time.ticks_diff(time.ticks_us(), t0)
+        stats[0] += 1; stats[1] += elapsed
+        if elapsed > stats[2]: stats[2] = elapsed
+        if deck.finished() and not self._fade_us:
+            self._finish() # 文件句柄留给 stop() 或下一次 play() 在主循环中关闭
+
+    def _swap_decks(self, t0):
         """
-        [修改] 填充指定的缓冲区 (0 or 1)。
+        切换到已装好的 _cue_deck，并以 t0 为新的时间原点。只在中断里或关中断时调用，
+        因此只交换引用、设置标志，不重设硬件定时器 (由 _start_timer() 在主循环中完成)。
         """
-        if self._file_fully_read[track_id] or self._buffer_is_full[track_id][buffer_to_fill_idx]:
-            return # 如果文件已读完，或此缓冲区已是满的，则不操作
-
-        buf = self._buffers[track_id][buffer_to_fill_idx]
-        bytes_read = self._file_handles[track_id].readinto(buf)
-        #print('polling')
-        if bytes_read > 0:
-            self._buffer_is_full[track_id][buffer_to_fill_idx] = True
-
-        if bytes_read < len(buf):
-            self._file_fully_read[track_id] = True
-            mv = memoryview(buf)
-            for i in range(bytes_read, len(buf)): mv[i] = 0
-
-    def _reset_and_play(self, song_info):
-        
-        self.stop(); time.sleep_ms(20); gc.collect()
-        
-        self._active_buf_idx, self._note_idx = [0, 0], [0, 0]
-        self._file_fully_read = [False, False]
-        self._buffer_is_full = [[False, False], [False, False]]
-        self._channel_mode = [_MODE_BGM, _MODE_BGM]
-        
+        self._retired = self._deck
+        self._retired.info = None # 播放过的 deck 不能再当作已 cue 好的乐曲，文件仍留给主循环关闭
+        self._deck, self._cue_deck = self._cue_deck, self._deck
+        self._start_time_us = t0
+        self._fade_us = 0
+        self._timer_reset = True
+        tm = self._telemetry
+        for i in range(_TM_EMPTY0, _TM_SIZE): tm[i] = 0
+        if self._scheduler == SCHED_PERIODIC: self._retime = True
+
+    def _start_timer(self):
+        """按当前 deck 启动定时器。不能在中断里或关中断期间调用。"""
+        self._retime = False
+        self._timer_reset = True
+        if self._scheduler == SCHED_PERIODIC:
+            self._expected_us = 1000000 // self._deck.timer_hz
+            self._timer.init(freq=self._deck.timer_hz, mode=machine.Timer.PERIODIC, callback=self._callback)
+        else: self._arm(0)
+
+    def _arm(self, delay_us):
+        """
+        一次性定时器模式: 在 delay_us 之后再触发一次中断。
+        以 tick_hz=1000000 直接给出周期 (us)，不用 freq= 换算，避免整数频率截断把长间隔推迟几百微秒。
+        """
+        if delay_us < _ONESHOT_MIN_US: delay_us = _ONESHOT_MIN_US
+        elif delay_us > _ONESHOT_MAX_US: delay_us = _ONESHOT_MAX_US
+        self._expected_us = delay_us
+        self._timer.init(period=delay_us, tick_hz=1000000, mode=machine.Timer.ONE_SHOT, callback=self._callback)
+
+    def _rebase(self):
+        """循环播放足够久后把时间原点前移一个周期，关中断保证中断看到的是一致的状态。"""
+        deck = self._deck
+        period = deck.loop_period_us
+        irq = machine.disable_irq()
+        self._start_time_us = time.ticks_add(self._start_time_us, period)
+        for track_id in (0, 1):
+            _shift_times(deck.notes[track_id], len(deck.notes[track_id]), deck.state[track_id], period)
+            deck.time_base_us[track_id] -= period
+        machine.enable_irq(irq)
+
+    def cue(self, music_name: str, loop: bool = False, precision: int = 4):
+        """
+        提前打开下一首乐曲，之后以相同参数调用 play() 时只需交换 deck。这里只读 metadata.txt、打开文件；
+        循环扫描和填充缓冲区由之后的 poll() (或补充线程) 分次完成，每次最多读 _CUE_SCAN_BLOCKS 块。
+        已经装好或正在装载同一首时不重复读取；淡出切换进行中时忽略。
+        """
+        song_info = (music_name, loop, precision)
+        deck = self._cue_deck
+        if self._fade_us or deck.info == song_info or deck.pending == song_info: return
+        with self._io_lock: self._begin_cue(song_info)
+
+    def play(self, music_name: str, loop: bool = False, precision: int = 4, fade_ms: int = 0):
+        """
+        播放乐曲。已经 cue() 过的乐曲直接切换，否则先同步装载。
+        fade_ms > 0 且正在播放时，当前乐曲在 fade_ms 内淡出后再切换。
+        """
+        with self._io_lock: self._play((music_name, loop, precision), fade_ms)
+
+    def _play(self, song_info, fade_ms):
+        if self._fade_us: # 上一次淡出还没结束，直接完成它
+            self._fade_us = 0
+        deck = self._cue_deck
+        if deck.info != song_info: # 没有 cue 过，或 cue 还没装完: 同步装完
+            if deck.pending != song_info and not self._begin_cue(song_info):
+                self._stop(); return
+            deck.step(self._raw, -1)
         self.last_song_info = song_info
-        music_name, self._loop, precision = song_info
-        song_dir = f"/bgm/{music_name}"
-        
-        try:
-            with open(f"{song_dir}/metadata.txt", "r") as f: bpm = float(f.readline().split(':')[1].strip())
-            self._64th_note_duration_us = int(60.0 * 1000000 / bpm / 16.0)
-            self._file_handles[0] = open(f"{song_dir}/0.msc", "rb")
-            self._file_handles[1] = open(f"{song_dir}/1.msc", "rb")
-        except (OSError, ValueError) as e:
-            print(f"错误: 无法加载 '{music_name}': {e}"); return
-            
-        #print(f"音频管理器: 加载 '{music_name}'...")
-        # --- 核心修正：初始化时，填满两个缓冲区 (0 和 1) ---
-        for track_id in range(2):
-            self._fill_buffer(track_id, 0) # 填充 0 号缓冲区
-            self._fill_buffer(track_id, 1) # 填充 1 号缓冲区
-        
-        self._start_time_us = time.ticks_us()
+        if fade_ms > 0 and self._is_playing_flag:
+            self._fade_start_us = time.ticks_us()
+            self._fade_us = fade_ms * 1000
+            return
+        irq = machine.disable_irq()
+        self._swap_decks(time.ticks_us())
+        self._channel_mode[0] = self._channel_mode[1] = _MODE_BGM
         self._is_playing_flag = True
-        
-        freq_hz = max(20, min(500, int(bpm / 60.0 * 16 * precision)))
-        #print(f"BPM: {bpm}, 定时器频率: {freq_hz} Hz")
-        self._timer.init(freq=freq_hz, mode=machine.Timer.PERIODIC, callback=self._timer_callback)
-
-    def play(self, music_name: str, loop: bool = False, precision: int = 4):
-        self._reset_and_play((music_name, loop, precision))
-        
+        machine.enable_irq(irq)
+        self._cue_deck.close() # 换下来的 deck 在主循环中关闭文件
+        self._retired = None
+        self._start_timer()
+
+    def _begin_cue(self, song_info):
+        """开始装载到备用 deck。淡出切换后它还是待关闭的 _retired，begin() 会先关闭它，不能再让 poll() 关一次。"""
+        if self._retired is self._cue_deck: self._retired = None
+        return self._cue_deck.begin(self._opener, song_info)
+
     def poll(self):
+        if not self._worker: self._refill() # 补充线程运行时由它负责
+
+    def _refill(self):
+        if self._retired:
+            self._retired.close(); self._retired = None
+        if self._retime and self._is_playing_flag: self._start_timer()
+        if self._cue_deck.pending and not self._fade_us: self._cue_deck.step(self._raw, _CUE_SCAN_BLOCKS)
+        self._refill_req = False
         if not self._is_playing_flag: return
-        
-        # --- 核心修正：poll() 的任务是填充非活动缓冲区 ---
+
+        # 填充已经播完的那个半区
+        deck, tm = self._deck, self._telemetry
         for track_id in range(2):
-            inactive_buf_idx = 1 - self._active_buf_idx[track_id]
-            self._fill_buffer(track_id, inactive_buf_idx)
+            inactive_buf_idx = 1 - deck.state[track_id][_ST_ACTIVE]
+            if deck.fill(track_id, inactive_buf_idx, self._raw) and tm[_TM_EMPTY0 + track_id]:
+                latency = time.ticks_diff(time.ticks_us(), tm[_TM_EMPTY0 + track_id])
+                tm[_TM_EMPTY0 + track_id] = 0; tm[_TM_REFILLS] += 1
+                if latency > tm[_TM_MAX_REFILL]: tm[_TM_MAX_REFILL] = latency
+        if deck.loop_period_us and deck.loop:
+            # 两个声道都已越过第一遍的结尾 (时间基准都不小于一个周期) 时才能整体前移
+            elapsed = time.ticks_diff(time.ticks_us(), self._start_time_us)
+            if elapsed > _REBASE_US and elapsed > deck.loop_start_us + deck.loop_period_us: self._rebase()
 
-    # stop() 和 is_playing() 保持不变
-    def stop(self):
-        if not self._is_playing_flag: return
+    def _finish(self):
+        """停止发声和定时器。可以在中断里调用，不关闭文件。"""
         self._is_playing_flag = False; self._timer.deinit()
         self._players[0].stop(); self._players[1].stop()
-        for i, f in enumerate(self._file_handles):
-            if f: f.close(); self._file_handles[i] = None
-        self._sfx_queue = [None, None]; self._channel_mode = [_MODE_BGM, _MODE_BGM]
-        #print("音频管理器: 已停止。")
+
+    def stop(self):
+        with self._io_lock: self._stop()
+
+    def _stop(self):
+        if self._is_playing_flag: self._finish()
+        self._fade_us = 0
+        self._deck.close()
+        if self._retired:
+            self._retired.close(); self._retired = None
+        self._channel_mode[0] = self._channel_mode[1] = _MODE_BGM
+
     def play_sfx(self, notes_list: list, channel: int = 0):
-        if not (0 <= channel < 2) or self._sfx_queue[channel] is not None:
+        if not (0 <= channel < 2) or self._channel_mode[channel] == _MODE_SFX:
             return
 
         # 如果定时器完全没有初始化过，就用默认频率启动它
-        # .deinit() 之后，timer 表现为 None-like
-        # 我们用 try-except 来安全地检查定时器状态
+        # 用 try-except 来安全地检查定时器状态
         try:
-            self._timer.freq() 
+            self._timer.freq()
         except: # 如果定时器未激活 (e.g., after deinit)
-            self._timer.init(freq=100, mode=machine.Timer.PERIODIC, callback=self._timer_callback)
-        
-        # 只要定时器在跑，我们就可以调度SFX
-        #print(f"音频管理器: 在通道 {channel} 上调度音效。")
-        self._sfx_queue[channel] = [notes_list, -1, time.ticks_ms()]
+            self._timer.init(freq=100, mode=machine.Timer.PERIODIC, callback=self._callback)
+
+        notes, state = self._sfx_notes[channel], self._sfx_state[channel]
+        _clear_state(state)
+        start_us, count = 0, min(len(notes_list), _SFX_MAX_NOTES)
+        for i in range(count):
+            freq, duration_ms = notes_list[i]
+            _set_note(notes, i * _NOTE_FIELDS, start_us, duration_ms * 1000, freq, _SFX_LOUDNESS)
+            start_us += duration_ms * 1000
+        state[_ST_COUNT0] = count
+        self._sfx_start_us[channel] = time.ticks_us()
         self._channel_mode[channel] = _MODE_SFX
-        self._players[channel].stop() # 为SFX让路
+        if self._scheduler == SCHED_ONESHOT and self._is_playing_flag: self._arm(0) # 不等当前的长间隔，立即开始音效
+
     def is_playing(self) -> bool:
-        return self._is_playing_flag
\ No newline at end of file
+        return self._is_playing_flag
+
+    def start_refill_thread(self, interval_ms: int = 10) -> bool:
+        """
+        启动补充线程，此后 poll() 不再做任何事。固件没有 _thread 时返回 False，继续由 poll() 补充。
+        线程经 opener 读取 .msc: opener 打开的文件不能与主线程共用句柄 (如同一个 PackReader 的子文件)。
+        """
+        if self._worker: return True
+        if not _thread: return False
+        self._io_lock = _thread.allocate_lock()
+        self._worker = True
+        _thread.start_new_thread(self._refill_worker, (interval_ms,))
+        return True
+
+    def stop_refill_thread(self):
+        """通知补充线程退出 (在它下一次醒来时)，之后恢复由 poll() 补充。"""
+        self._worker = False
+
+    def _refill_worker(self, interval_ms):
+        while self._worker:
+            with self._io_lock: self._refill()
+            # 有补充请求时只让出一下 CPU 就再检查，否则按间隔休眠
+            time.sleep_ms(0 if self._refill_req else interval_ms)
+
+    def refill_pending(self) -> bool:
+        """正在播放的半区快用完而另一半还空着，应尽快调用 poll()。"""
+        return self._refill_req
+
+    def stats(self) -> dict:
+        """播放遥测: 缓冲配置、欠载/补充/抖动、中断耗时和音符起始延迟。"""
+        stats, tm = self._isr_stats, self._telemetry
+        onsets = late_sum = late_max = 0
+        for deck in (self._deck, self._cue_deck):
+            for state in deck.state:
+                onsets += state[_ST_ONSETS]; late_sum += state[_ST_LATE_SUM]
+                late_max = max(late_max, state[_ST_LATE_MAX])
+        return {'buffer_notes': self._half, 'low_water': self._low_water,
+                'underruns': tm[_TM_UNDERRUNS], 'refills': tm[_TM_REFILLS],
+                'max_refill_us': tm[_TM_MAX_REFILL], 'max_jitter_us': tm[_TM_MAX_JITTER],
+                'isr_count': stats[0], 'isr_avg_us': stats[1] // stats[0] if stats[0] else 0, 'isr_max_us': stats[2],
+                'onsets': onsets, 'late_avg_us': late_sum // onsets if onsets else 0, 'late_max_us': late_max}
+
+    def reset_stats(self):
+        for i in range(3): self._isr_stats[i] = 0
+        for i in range(_TM_LAST_TICK): self._telemetry[i] = 0
+        for deck in (self._deck, self._cue_deck):
+            for state in deck.state:
+                state[_ST_ONSETS] = state[_ST_LATE_SUM] = state[_ST_LATE_MAX] = 0
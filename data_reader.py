@@ -1,32 +1,208 @@
 # data_reader.py
-import os
+import struct
+import micropython
+from micropython import const
+
+# RDAT 容器 (由 trdat.py 生成): 16 字节文件头 + uint16 索引表 + [偏移表] + 去重后的物理块
+_DAT_MAGIC = b'RDAT'
+_DAT_VERSION = const(1)
+_DAT_HEADER_SIZE = const(16)
+_DAT_FLAG_COMPRESSED = const(0x01)
+
+@micropython.viper
+def _unpackbits(src, src_len: int, dst, dst_len: int) -> int:
+    """PackBits 解码到预分配的缓冲区，返回写入的字节数。"""
+    s = ptr8(src); d = ptr8(dst)
+    i = 0; o = 0
+    while i < src_len and o < dst_len:
+        n = s[i]; i += 1
+        if n < 128:
+            n += 1
+            while n > 0 and i < src_len and o < dst_len:
+                d[o] = s[i]; o += 1; i += 1; n -= 1
+        elif n > 128:
+            n = 257 - n
+            v = s[i]; i += 1
+            while n > 0 and o < dst_len:
+                d[o] = v; o += 1; n -= 1
+    return o
+
+class ChunkCache:
+    """
+    按字节预算淘汰的 LRU 数据块缓存，可由多个 DataReader 共享。
+    键为整数 (读取器标签 | 块索引)，避免每次查找都分配元组。
+    """
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self._entries = {} # key -> [data, last_used_stamp]
+        self._used = 0
+        self._clock = 0
+        self._next_tag = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    def register(self):
+        """为一个读取器分配唯一的键前缀 (高 16 位)。"""
+        self._next_tag += 1
+        return self._next_tag << 16
+
+    def contains(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[0]
+
+    def put(self, key, data):
+        size = len(data)
+        if size > self.budget: return
+        old = self._entries.pop(key, None)
+        if old: self._used -= len(old[0])
+        while self._entries and self._used + size > self.budget:
+            self._evict_one()
+        self._clock += 1
+        self._entries[key] = [data, self._clock]
+        self._used += size
+
+    def _evict_one(self):
+        # 条目数很少 (预算 / 块大小)，线性扫描最久未用的条目即可
+        victim_key, victim_stamp = None, None
+        for key, entry in self._entries.items():
+            if victim_stamp is None or entry[1] < victim_stamp:
+                victim_key, victim_stamp = key, entry[1]
+        self._used -= len(self._entries.pop(victim_key)[0])
+
+    def clear(self):
+        self._entries = {}
+        self._used = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'prefetches': self.prefetches,
+                'entries': len(self._entries), 'used': self._used, 'budget': self.budget}
 
 class DataReader:
-    def __init__(self, filepath, chunk_size):
+    def __init__(self, filepath, chunk_size, cache=None, opener=open):
         self.chunk_size = chunk_size
         self._file = None
         self._total_chunks = 0
+        self._cache = cache
+        self._cache_tag = cache.register() if cache else 0
+        self._chunk_map = None # 逻辑索引 -> 物理块编号 (仅 RDAT 容器)
+        self._data_offset = 0
+        self._offsets = None   # 压缩容器的物理块偏移表
+        self._packed_buf = None
+        self._decode_buf = None
         try:
-            file_size = os.stat(filepath)[6]
-            if file_size > 0 and chunk_size > 0:
+            self._file = opener(filepath, 'rb')
+            file_size = self._file.seek(0, 2)
+            self._file.seek(0)
+            header = self._file.read(_DAT_HEADER_SIZE)
+            if len(header) == _DAT_HEADER_SIZE and header[:4] == _DAT_MAGIC:
+                self._open_container(filepath, header)
+            elif file_size > 0 and chunk_size > 0:
                 self._total_chunks = file_size // chunk_size
-            self._file = open(filepath, 'rb')
-        except OSError:
-            print(f"错误: 无法打开或找到数据文件 '{filepath}'")
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法打开或找到数据文件 '{filepath}': {e}")
+            if self._file: self._file.close()
             self._file = None
             self._total_chunks = 0
 
-    def read_chunk(self, index):
-        if not self._file or not (0 <= index < self._total_chunks):
-            return None
+    def _open_container(self, filepath, header):
+        version, flags, chunk_size, logical_count, physical_count = struct.unpack_from('<BBHHH', header, 4)
+        if version != _DAT_VERSION:
+            raise ValueError(f"不支持的容器版本 {version}")
+        if chunk_size != self.chunk_size:
+            print(f"警告: '{filepath}' 的块大小为 {chunk_size}，与预期的 {self.chunk_size} 不符，以文件头为准。")
+            self.chunk_size = chunk_size
+        self._chunk_map = self._file.read(2 * logical_count)
+        self._data_offset = _DAT_HEADER_SIZE + 2 * logical_count
+        if flags & _DAT_FLAG_COMPRESSED:
+            self._offsets = self._file.read(4 * (physical_count + 1))
+            self._data_offset += 4 * (physical_count + 1)
+            # 压缩块不会大于原始块 (否则按原样存放)，两个缓冲区都按块大小预分配
+            self._packed_buf = bytearray(chunk_size)
+            self._decode_buf = bytearray(chunk_size)
+        self._total_chunks = logical_count
+
+    def _physical_index(self, index):
+        chunk_map = self._chunk_map
+        if chunk_map is None: return index
+        return chunk_map[2 * index] | (chunk_map[2 * index + 1] << 8)
+
+    def _read_raw(self, index, dst=None):
+        """
+        读取一个物理块。dst 为 None 时: 压缩块解码到预分配的 _decode_buf，返回它的 memoryview
+        (只在下一次读取之前有效，调用方立即绘制即可)；否则直接读入/解码到 dst (如新的缓存条目) 并返回 dst。
+        """
         try:
-            offset = index * self.chunk_size
+            if self._offsets is not None:
+                return self._read_packed(index, dst)
+            offset = self._data_offset + index * self.chunk_size
             self._file.seek(offset)
-            return self._file.read(self.chunk_size)
+            if dst is None: return self._file.read(self.chunk_size)
+            self._file.readinto(dst)
+            return dst
         except Exception as e:
             print(f"读取数据块 {index} 时发生错误: {e}")
             return None
 
+    def _read_packed(self, index, dst):
+        start, end = struct.unpack_from('<II', self._offsets, 4 * index)
+        size = end - start
+        self._file.seek(self._data_offset + start)
+        if dst is None: dst = self._decode_buf
+        if size >= self.chunk_size: # 未压缩的块
+            if self._file.readinto(dst) != self.chunk_size:
+                raise OSError("数据块读取不完整")
+        else:
+            packed = memoryview(self._packed_buf)[:size]
+            if self._file.readinto(packed) != size:
+                raise OSError("压缩块读取不完整")
+            if _unpackbits(self._packed_buf, size, dst, self.chunk_size) != self.chunk_size:
+                raise ValueError("压缩块解码长度错误")
+        return memoryview(dst) if dst is self._decode_buf else dst
+
+    def read_chunk(self, index):
+        if not self._file or not (0 <= index < self._total_chunks):
+            return None
+        # 缓存按物理块索引，重复的帧共享同一个缓存条目
+        index = self._physical_index(index)
+        cache = self._cache
+        if cache:
+            data = cache.get(self._cache_tag | index)
+            if data is not None:
+                cache.hits += 1
+                return data
+            cache.misses += 1
+            # 直接读入/解码到新的缓存条目，不再经过共享缓冲区复制一次
+            data = self._read_raw(index, bytearray(self.chunk_size))
+            if data: cache.put(self._cache_tag | index, data)
+            return data
+        return self._read_raw(index)
+
+    def prefetch(self, index):
+        """
+        预先把数据块读入共享缓存。仅在真正访问了 Flash 时返回 True。
+        """
+        cache = self._cache
+        if not (cache and self._file and 0 <= index < self._total_chunks):
+            return False
+        index = self._physical_index(index)
+        key = self._cache_tag | index
+        if cache.contains(key):
+            return False
+        data = self._read_raw(index, bytearray(self.chunk_size))
+        if not data:
+            return False
+        cache.put(key, data)
+        cache.prefetches += 1
+        return True
+
     def __len__(self):
         return self._total_chunks
 
@@ -40,4 +216,4 @@ class DataReader:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
\ No newline at end of file
+        self.close()
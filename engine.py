@@ -1,11 +1,13 @@
-# engine.py (V3.0 - In-Memory Index)
+# engine.py (V3.1 - Compact / Paged Index)
 import time
 import struct
-import os
+import framebuf
+from array import array
 from ufont import BMFont
 from buzzer_player import SongPlayer
 from data_reader import DataReader
-import ucrc32
+from script_index import FlatIndex, CompactIndex, open_index
+import utrace
 from micropython import const
 from utils import draw_image, draw_rect
 
@@ -15,155 +17,398 @@ _CHOICE_BOX_W = const(68)
 _CHOICE_BOX_H = const(11)
 _CHOICE_TEXT_X_OFFSET = const(1)
 
+# --- 场景区域 (背景 + 三个立绘位) ---
+_SCENE_X = const(32)
+_SCENE_Y = const(16)
+_SCENE_W = const(96)
+_SCENE_H = const(48)
+
+# --- 脚本读取 ---
+_READAHEAD_BYTES = const(2048) # 分离布局 (final_script.txt) 的预读窗口大小
+_LOOKAHEAD_WINDOW_BYTES = const(512) # 向后扫描专用的预读窗口，不与执行用的窗口争用
+
+# --- 扇区对齐脚本 (trsc.py --layout sector) ---
+_SCRIPT_MAGIC = b'RSCR'
+_SCRIPT_VERSION = const(1)
+_SCRIPT_TRAILER_SIZE = const(16)
+
+# --- 资源预取 ---
+_STEP_BUDGET = const(32) # 每帧最多连续执行的指令数，防止长串指令饿死输入和音频填充
+_LOOKAHEAD_LINES = const(8) # 等待确认期间向后扫描的脚本行数 (每帧一行)
+
+# --- 快进 (已读跳过) ---
+_SKIP_STEP_BUDGET = const(128) # 快进时每帧最多执行的指令数
+_SKIP_FRAME_MS = const(100)    # 快进时的画面刷新间隔
+_SEEN_FILE = 'seen.dat'
+_SEEN_MAGIC = b'RSEN'
+_SEEN_VERSION = const(1)
+_SEEN_HEADER_FORMAT = '<4sB3xI' # 魔数, 版本, 行数；其后为每行 1 位的已读位图
+_SEEN_HEADER_SIZE = const(12)
+
+# --- 埋点开关 (编译期常量，为 0 时相应代码被整段去除) ---
+_TRACE = const(1)       # 事件环形缓冲与耗时直方图
+_TRACE_DEBUG = const(0) # 逐行打印执行的脚本内容 (经串口输出很慢，只在排查脚本问题时打开)
+
+# --- 等待模式 ---
+_WAIT_NONE = const(0)
+_WAIT_CONFIRM = const(1)
+_WAIT_CHOICE = const(2)
+_WAIT_AUTO = const(3)
+_WAIT_MENU = const(4)
+_WAIT_PENDING_LOAD = const(5)
+_WAIT_BACKLOG = const(6)
+
+# --- 回看 (已显示过的对话) ---
+_BACKLOG_SIZE = const(32) # 环形缓冲的条目数，每条 12 字节 (PC + BG/三个 CG)
+
+# --- 画面状态 ---
+_NO_ASSET = const(0xFFFF) # 与存档格式一致，表示该位置为空
+_CG_POS_CHARS = 'lcr' # ^CG 的位置字符，下标即立绘位 (左/中/右)
+_CG_X = (1, 36, 73)
+_DAY_NAMES = ('SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT')
+_MONTH_NAMES = ("???", "J A N", "F E B", "M A R", "A P R", "M A Y", "J U N", "J U LY", "A U G", "S E P", "O C T", "N O V", "D E C")
+_SAVE_FORMAT_INTS = '<IHBBBHHHH'
+_QUICK_SLOT = const(0) # Q.Save / Q.Load 使用的存档槽位
+
+# --- 场景关键帧表 (trsc.py 生成的 final_script.kfr，格式见 trsc.py) ---
+_KFR_MAGIC = b'RKEY'
+_KFR_VERSION = const(1)
+_KFR_HEADER_SIZE = const(16)
+_KFR_RECORD_SIZE = const(17) # 与 _SAVE_FORMAT_INTS 相同，第一个字段为行号
+_KFR_CHAPTER_SIZE = const(26)
+_KFR_NAME_SIZE = const(24)
+
+class _LineWindow:
+    """脚本的一个预读窗口及其索引游标。执行与向后扫描各用一个，交错读取时互不打乱对方的窗口和索引缓存。"""
+    __slots__ = ('index', 'buf', 'align', 'start', 'len')
+    def __init__(self, index, size: int, align: int = 1):
+        self.index = index
+        self.buf = bytearray(size)
+        self.align = align # 填充起点对齐 (扇区布局为扇区大小)
+        self.start = 0
+        self.len = 0
+
 class ScriptEngine:
-    def __init__(self, display, font: BMFont, music_player: SongPlayer, bg_reader: DataReader, cg_reader: DataReader):
+    __slots__ = ('display', 'font', 'music_player', 'bg_reader', 'cg_reader', 'sound_enabled', 'save_store',
+                 '_script_file_handle', '_index', '_index_file', '_total_lines',
+                 '_window', '_lookahead_window', '_script_end',
+                 '_pc', '_is_running', '_wait_mode', '_month', '_day', '_dow',
+                 '_bg', '_cg', '_bgm_idx', '_choice_options', '_selected_choice',
+                 'sidebar_options', 'sidebar_selection', '_auto_mode', '_auto_wait_until_ms',
+                 '_lookahead_pc', '_lookahead_left', '_scene_buf', '_scene_fb',
+                 '_scene_valid', '_scene_dirty', '_batching', '_display_dirty', 'profiler',
+                 '_keyframes', '_chapters', '_seen', '_seen_dirty',
+                 '_skip_mode', '_skip_frame_ms', '_skip_start_ms', '_skip_lines',
+                 '_backlog_pc', '_backlog_scene', '_backlog_head', '_backlog_count',
+                 '_backlog_cursor', '_backlog_return_mode')
+
+    def __init__(self, display, font: BMFont, music_player: SongPlayer, bg_reader: DataReader, cg_reader: DataReader, opener=open, index_paged=False, save_store=None):
         self.display = display
         self.font = font
         self.music_player = music_player
         self.bg_reader = bg_reader
         self.cg_reader = cg_reader
         self.sound_enabled = True
+        self.save_store = save_store # save_store.SaveStore，存档日志
         
         self._script_file_handle = None
-        self._index_data = None # 将用于存储整个索引文件内容
+        self._index = None # 行偏移索引 (FlatIndex 或 CompactIndex)
+        self._index_file = None # 分页紧凑索引单独打开的 final_script.cdx
         self._total_lines = 0
+        self._window = None # 预读窗口: 扇区布局为一个扇区，分离布局为 _READAHEAD_BYTES
+        self._lookahead_window = None
+        self._script_end = 0
+        self._seen = None # 已读位图，每个输出行 1 位
+        self._seen_dirty = False
+        self._skip_mode = False
+        self._skip_frame_ms = 0
+        self._skip_start_ms = 0
+        self._skip_lines = 0
+        # 回看环形缓冲: 只记录对话所在的 PC 和当时的画面，文字回看时经索引重新读取
+        self._backlog_pc = array('I', [0] * _BACKLOG_SIZE)
+        self._backlog_scene = array('H', [_NO_ASSET] * (4 * _BACKLOG_SIZE)) # BG, 左/中/右 CG
+        self._backlog_head = 0
+        self._backlog_count = 0
+        self._backlog_cursor = 0
+        self._backlog_return_mode = _WAIT_CONFIRM
         
         try:
-            # --- [REFACTOR] 一次性加载整个索引文件 ---
+            # --- 加载脚本索引: 扇区布局内嵌索引 > 紧凑索引 (.cdx) > 平铺索引 (.idx) ---
             print("正在加载脚本索引到内存...")
-            with open('final_script.idx', 'rb') as f_idx:
-                self._index_data = f_idx.read()
-            
-            self._total_lines = len(self._index_data) // 4
-            self._script_file_handle = open('final_script.txt', 'r', encoding='utf-8')
+            if not self._open_sector_script(opener, index_paged):
+                try:
+                    f_cdx = opener('final_script.cdx', 'rb')
+                except OSError:
+                    f_cdx = None
+                if f_cdx:
+                    self._index = CompactIndex(f_cdx, 0, index_paged)
+                    if index_paged: self._index_file = f_cdx
+                    else: f_cdx.close()
+                else:
+                    with opener('final_script.idx', 'rb') as f_idx:
+                        self._index = FlatIndex(f_idx.read())
+                
+                self._total_lines = self._index.count
+                self._script_file_handle = opener('final_script.txt', 'rb')
+                self._script_end = self._script_file_handle.seek(0, 2)
+                self._window = _LineWindow(self._index, _READAHEAD_BYTES)
+            self._lookahead_window = _LineWindow(self._index.fork(), _LOOKAHEAD_WINDOW_BYTES)
             
-            print(f"脚本引擎: 成功加载索引 ({self._total_lines} 行) 并打开脚本。")
+            print(f"脚本引擎: 成功加载索引 ({self._total_lines} 行，常驻 {self._index.resident_bytes()} 字节) 并打开脚本。")
         except Exception as e:
             print(f"致命错误: 脚本或索引文件打开失败! {e}")
             self.stop()
             
         self._pc = 0
         self._is_running = False
-        self._wait_mode = 'none'
-        self._game_date = {'month': 7, 'day': 17, 'dow': 1}
-        self._day_map = {0:'SUN', 1:'MON', 2:'TUE', 3:'WED', 4:'THU', 5:'FRI', 6:'SAT'}
-        self._month_map = {1:"J A N", 2:"F E B", 3:"M A R", 4:"A P R", 5:"M A Y", 6:"J U N", 7:"J U LY", 8:"A U G", 9:"S E P", 10:"O C T", 11:"N O V", 12:"D E C"}
-        self._screen_state = {'bg': None, 'cg_l': None, 'cg_c': None, 'cg_r': None, 'bgm_idx': 65535}
+        self._wait_mode = _WAIT_NONE
+        self._month, self._day, self._dow = 7, 17, 1
+        self._bg = _NO_ASSET
+        self._cg = [_NO_ASSET, _NO_ASSET, _NO_ASSET] # 按立绘位 (左/中/右) 存放
+        self._bgm_idx = _NO_ASSET
         self._choice_options = []
         self._selected_choice = 0
-        self.sidebar_options = [" Q.Save ", "  Auto  ", " Q.Load ", "  HOME  ", "返回游戏"]
+        self.sidebar_options = (" Q.Save ", "  Auto  ", "  Skip  ", " Q.Load ", "  HOME  ", "返回游戏")
         self.sidebar_selection = 0
-        self._save_format_ints = '<IHBBBHHHH'
         self._auto_mode = False
         self._auto_wait_until_ms = 0
+        self._lookahead_pc = 0
+        self._lookahead_left = 0
+        # 合成后的场景快照，仅在背景或立绘变化时失效
+        self._scene_buf = bytearray(_SCENE_W * _SCENE_H // 8)
+        self._scene_fb = framebuf.FrameBuffer(self._scene_buf, _SCENE_W, _SCENE_H, framebuf.MONO_HLSB)
+        self._scene_valid = False
+        self._scene_dirty = False # 场景已变化但尚未重绘 (批量执行结束时统一处理)
+        self._batching = False
+        self._display_dirty = False
+        self.profiler = None # 可选的 script_profile.ScriptProfiler，由 main.py 挂载
+        self._keyframes = None # 关键帧记录 (常驻)，没有 final_script.kfr 时为 None
+        self._chapters = ()    # ((标签名, 行号), ...)
+        self._load_keyframes(opener)
+        self._load_seen()
 
     def start(self, start_line_num_0_based: int = 0):
+        """从指定行开始执行。有关键帧表时直接还原该行之前的画面、音乐和日期。"""
         print(f"脚本引擎: 从第 {start_line_num_0_based + 1} 行开始执行。")
         self._pc = start_line_num_0_based
         self._is_running = True
-        self._wait_mode = 'none'
-        self._screen_state = {'bg': None, 'cg_l': None, 'cg_c': None, 'cg_r': None, 'bgm_idx': 65535}
+        self._wait_mode = _WAIT_NONE
+        self._backlog_count = 0
+        if self._keyframes:
+            self._apply_state(self._state_at(start_line_num_0_based))
+        else:
+            self._bg = _NO_ASSET
+            self._cg[0] = self._cg[1] = self._cg[2] = _NO_ASSET
+            self._bgm_idx = _NO_ASSET
+        self._scene_valid = False
         self._redraw_scene()
         self._draw_sidebar()
+
+    def chapters(self):
+        return self._chapters
+
+    def _load_keyframes(self, opener):
+        try:
+            f = opener('final_script.kfr', 'rb')
+        except OSError:
+            return
+        with f:
+            try:
+                magic, version, _, count, chapter_count = struct.unpack('<4sBxHHH4x', f.read(_KFR_HEADER_SIZE))
+                if magic != _KFR_MAGIC or version != _KFR_VERSION or count == 0:
+                    raise ValueError("魔数或版本不符")
+                keyframes = f.read(count * _KFR_RECORD_SIZE)
+                if len(keyframes) != count * _KFR_RECORD_SIZE: raise ValueError("关键帧表不完整")
+                chapters = []
+                for _ in range(chapter_count):
+                    entry = f.read(_KFR_CHAPTER_SIZE)
+                    name = bytes(entry[:_KFR_NAME_SIZE])
+                    end = name.find(b'\x00')
+                    if end >= 0: name = name[:end]
+                    keyframe_id = struct.unpack_from('<H', entry, _KFR_NAME_SIZE)[0]
+                    chapters.append((str(name, 'utf-8'), struct.unpack_from('<I', keyframes, keyframe_id * _KFR_RECORD_SIZE)[0]))
+            except ValueError as e: # 文件被截断或损坏时按没有关键帧处理
+                print(f"警告: final_script.kfr 格式不正确 ({e})，已忽略。"); return
+            self._keyframes = keyframes
+            self._chapters = tuple(chapters)
+        print(f"脚本引擎: 已加载 {count} 个场景关键帧，{chapter_count} 个章节。")
+
+    def _state_at(self, line: int) -> list:
+        """
+        执行第 line 行 (从 0 开始) 之前的 [BGM, 月, 日, 星期, BG, 左CG, 中CG, 右CG]。
+        二分查找不晚于该行的关键帧，再折叠其后最多 K 行中的状态指令 (不执行、不绘制)。
+        状态按脚本的线性顺序推算，经过跳转或选项到达时可能与实际游玩不同。
+        """
+        keyframes = self._keyframes
+        lo, hi = 0, len(keyframes) // _KFR_RECORD_SIZE - 1
+        while lo < hi:
+            mid = (lo + hi + 1) >> 1
+            if struct.unpack_from('<I', keyframes, mid * _KFR_RECORD_SIZE)[0] <= line: lo = mid
+            else: hi = mid - 1
+        fields = struct.unpack_from(_SAVE_FORMAT_INTS, keyframes, lo * _KFR_RECORD_SIZE)
+        state = list(fields[1:])
+        for pc in range(fields[0], min(line, self._total_lines)):
+            self._fold_line(state, self._get_line(pc + 1))
+        return state
+
+    @staticmethod
+    def _fold_line(state: list, line: str):
+        """把一行中影响画面/音乐/日期的指令作用到 state 上 (与 trsc.fold_scene_state 一致)。"""
+        if not line.startswith('^'): return
+        parts = line.split()
+        command = parts[0].upper()
+        try:
+            if command == '^BG': state[4] = int(parts[1]); state[5] = state[6] = state[7] = _NO_ASSET
+            elif command == '^CG':
+                pos = _CG_POS_CHARS.find(parts[1]) if len(parts[1]) == 1 else -1
+                if pos >= 0: state[5 + pos] = int(parts[2])
+            elif command == '^BGM': state[0] = int(parts[1])
+            elif command == '^BGMSTOP': state[0] = _NO_ASSET
+            elif command == '^D': state[1], state[2], state[3] = int(parts[1][0:2]), int(parts[1][2:4]), int(parts[1][4])
+        except (IndexError, ValueError): pass
+
+    def _apply_state(self, state: list):
+        self._bgm_idx, self._month, self._day, self._dow, self._bg = state[0], state[1], state[2], state[3], state[4]
+        self._cg[0], self._cg[1], self._cg[2] = state[5], state[6], state[7]
+        self._scene_valid = False
+        if self._bgm_idx != _NO_ASSET and self.sound_enabled:
+            self.music_player.play(f"{self._bgm_idx:02d}", loop=True)
     
     def stop(self):
         self._is_running = False
+        if self._skip_mode: self._stop_skip()
+        self._save_seen()
         if self._script_file_handle: self._script_file_handle.close(); self._script_file_handle = None
-        self._index_data = None # 释放内存
+        if self._index_file: self._index_file.close(); self._index_file = None
+        self._index = None # 释放内存
+        self._window = self._lookahead_window = None
         print("脚本引擎: 已停止，所有文件句柄已关闭，索引内存已释放。")
 
     def is_running(self) -> bool:
         return self._is_running
 
-    def _get_line(self, line_num_1_based: int) -> str:
+    def line_count(self) -> int:
+        return self._total_lines
+
+    def is_idle(self) -> bool:
+        """是否停在等待玩家输入 (或自动模式计时) 的状态，适合安排垃圾回收等杂务。"""
+        return self._wait_mode != _WAIT_NONE and self._wait_mode != _WAIT_PENDING_LOAD
+
+    def _open_sector_script(self, opener, index_paged: bool) -> bool:
+        """尝试打开扇区对齐、索引内嵌的 final_script.bin，成功时返回 True。"""
+        try:
+            f = opener('final_script.bin', 'rb')
+        except OSError:
+            return False
+        file_size = f.seek(0, 2)
+        f.seek(file_size - _SCRIPT_TRAILER_SIZE)
+        trailer = f.read(_SCRIPT_TRAILER_SIZE)
+        magic, version, sector_size, line_count, index_offset = struct.unpack('<4sBxHII', trailer)
+        if magic != _SCRIPT_MAGIC or version != _SCRIPT_VERSION:
+            print("警告: final_script.bin 格式不正确，改用 final_script.txt。")
+            f.close()
+            return False
+        self._index = open_index(f, index_offset, line_count, index_paged)
+        self._total_lines = line_count
+        self._script_end = index_offset
+        self._window = _LineWindow(self._index, sector_size, sector_size)
+        self._script_file_handle = f
+        return True
+
+    def _fill_window(self, window, pos: int):
+        if _TRACE: utrace.event(utrace.EV_READ, pos)
+        self._script_file_handle.seek(pos)
+        window.len = self._script_file_handle.readinto(window.buf) or 0
+        window.start = pos
+
+    def _get_line(self, line_num_1_based: int, window=None) -> str:
         """
-        [终极校验版] 校验从内存解包的索引值，并验证 seek 操作。
+        从预读窗口 (默认为执行用的窗口) 中切出一行。顺序执行时绝大多数行都命中窗口，只是一次内存切片；
+        跳出窗口时才 seek + readinto 重新填充 (扇区布局按扇区对齐填充)。
+        返回的行可能带有 '\n' (以及扇区填充)，调用方会统一 rstrip。
         """
-        if not (self._index_data and self._script_file_handle and 1 <= line_num_1_based <= self._total_lines):
+        if not (self._index and self._script_file_handle and 1 <= line_num_1_based <= self._total_lines):
             return ""
-        
-        index_offset = (line_num_1_based - 1) * 4
-        
-        # --- 校验点 1: 解包索引值 ---
-        # 我们一次性解包前几个值，看看它们是否与您的十六进制 dump 匹配
-        if line_num_1_based == 1:
-            offset1, offset2, offset3 = struct.unpack_from('<III', self._index_data, 0)
-            print(f"  VALIDATION: Index offsets for lines 1, 2, 3 are: {offset1}, {offset2}, {offset3}")
-            # 根据您提供的 dump: 应该是 0, 7, 17
-            
-        script_offset = struct.unpack_from('<I', self._index_data, index_offset)[0]
-        
-        print(f"  _get_line({line_num_1_based}): Unpacked script_offset = {script_offset}")
-
-        # --- 校验点 2: 验证 seek 操作 ---
-        current_pos_before_seek = self._script_file_handle.tell()
-        self._script_file_handle.seek(script_offset)
-        current_pos_after_seek = self._script_file_handle.tell()
-        
-        print(f"  _get_line({line_num_1_based}): Seek from {current_pos_before_seek} to {script_offset}. Position after seek: {current_pos_after_seek}")
-
-        # --- 校验点 3: 检查 seek 是否成功 ---
-        if current_pos_after_seek != script_offset:
-            print(f"  FATAL ERROR: seek() FAILED! Tried to seek to {script_offset}, but ended up at {current_pos_after_seek}")
-            # 可以在这里抛出异常或进入死循环来明确指示错误
-            while True: pass
-
-        line_content = self._script_file_handle.readline()
-        
-        print(f"  _get_line({line_num_1_based}): Read content: {repr(line_content)}")
-        return line_content
-    def update(self, confirm_pressed: bool, next_pressed: bool, menu_pressed: bool):
-        if self._wait_mode == 'none':
-            print(f"--- PC: {self._pc} ---")
-
+        if window is None: window = self._window
+        index = window.index
+        start = index.offset(line_num_1_based - 1)
+        if line_num_1_based < self._total_lines:
+            end = index.offset(line_num_1_based)
+        else:
+            end = self._script_end
+        rel = start - window.start
+        if rel < 0 or end - window.start > window.len:
+            if end - start > len(window.buf): # 比窗口还长的行，直接读取
+                self._script_file_handle.seek(start)
+                return str(self._script_file_handle.read(end - start), 'utf-8')
+            self._fill_window(window, start - start % window.align)
+            rel = start - window.start
+        return str(memoryview(window.buf)[rel:rel + end - start], 'utf-8')
+
+    def update(self, confirm_pressed: bool, next_pressed: bool, menu_pressed: bool, backlog_pressed: bool = False):
         if not self._is_running: return
         
-        if self._wait_mode == 'pending_load':
+        if self._wait_mode == _WAIT_PENDING_LOAD:
             self.load_state(from_title_menu=False) # 调用真正的读档逻辑
             return # 读档后立即返回，等待下一帧再开始执行脚本
+
+        if self._wait_mode == _WAIT_BACKLOG:
+            if menu_pressed: self._close_backlog()
+            elif next_pressed: self._backlog_step(1)    # 往前翻
+            elif confirm_pressed: self._backlog_step(-1) # 往后翻，翻过最新一页即退出
+            return
+        if backlog_pressed and (self._wait_mode == _WAIT_CONFIRM or self._wait_mode == _WAIT_AUTO):
+            self._open_backlog()
+            return
         
         if menu_pressed:
-            if self._wait_mode == 'menu':
-                self._wait_mode = 'none'
+            if self._wait_mode == _WAIT_MENU:
+                self._wait_mode = _WAIT_NONE
                 self._redraw_scene(); self._draw_sidebar()
             else:
                 if self._auto_mode: self._auto_mode = False; self._draw_sidebar()
-                self._wait_mode = 'menu'
+                if self._skip_mode: self._stop_skip()
+                self._wait_mode = _WAIT_MENU
                 self.sidebar_selection = 0
                 self._draw_sidebar()
             return
 
         if self._auto_mode and (confirm_pressed or next_pressed):
             self._auto_mode = False; self._draw_sidebar()
+        if self._skip_mode and (confirm_pressed or next_pressed):
+            self._stop_skip(); self._draw_sidebar()
+            confirm_pressed = next_pressed = False # 这次按键只用于停止快进
         
-        if self._wait_mode == 'confirm':
-            if confirm_pressed:
-                self._pc += 1
-                self._wait_mode = 'none'
-            return
+        wait_mode = self._wait_mode
+        if wait_mode == _WAIT_CONFIRM:
+            if not confirm_pressed:
+                self._lookahead_step()
+                return
+            self._pc += 1
+            self._wait_mode = _WAIT_NONE
             
-        elif self._wait_mode == 'choice':
+        elif wait_mode == _WAIT_CHOICE:
             self._auto_mode = False
             if next_pressed:
                 old_selection = self._selected_choice
                 self._selected_choice = (self._selected_choice + 1) % len(self._choice_options)
                 self._draw_single_choice(old_selection, is_selected=False)
                 self._draw_single_choice(self._selected_choice, is_selected=True)
-                self.display.show()
-            elif confirm_pressed:
-                target_line = self._choice_options[self._selected_choice][1]
-                self._pc = target_line - 1
-                self._wait_mode = 'none'
-                self._redraw_scene()
-            return
+                self._flush()
+            if not confirm_pressed: return
+            target_line = self._choice_options[self._selected_choice][1]
+            self._pc = target_line - 1
+            self._wait_mode = _WAIT_NONE
+            self._scene_dirty = True # 擦除选项框，随本帧的合并刷新一起完成
             
-        elif self._wait_mode == 'auto':
-            if time.ticks_diff(time.ticks_ms(), self._auto_wait_until_ms) > 0:
-                self._pc += 1
-                self._wait_mode = 'none'
-            return
-
-        elif self._wait_mode == 'menu':
+        elif wait_mode == _WAIT_AUTO:
+            if time.ticks_diff(time.ticks_ms(), self._auto_wait_until_ms) <= 0:
+                self._lookahead_step()
+                return
+            self._pc += 1
+            self._wait_mode = _WAIT_NONE
+
+        elif wait_mode == _WAIT_MENU:
             if next_pressed:
                 self.sidebar_selection = (self.sidebar_selection + 1) % len(self.sidebar_options)
                 self._draw_sidebar()
@@ -171,22 +416,84 @@ class ScriptEngine:
                 self._execute_sidebar_action()
             return
 
-        if self._pc < self._total_lines:
-            line_content = self._get_line(self._pc + 1)
-            line_stripped = line_content.rstrip('\r\n')
+        self._run_until_wait()
 
-            print(f"  EXECUTING: {repr(line_stripped)}")
-            
+    def _run_until_wait(self):
+        """
+        连续执行不需要等待的指令，直到进入等待状态、脚本结束或用完本帧的指令预算，
+        期间所有的画面更新合并为结束时的一次场景重绘和一次屏幕刷新。
+        """
+        self._batching = True
+        budget = _SKIP_STEP_BUDGET if self._skip_mode else _STEP_BUDGET
+        profiler = self.profiler
+        while self._wait_mode == _WAIT_NONE and self._is_running and budget > 0:
+            if self._pc >= self._total_lines:
+                self.stop(); break
+            if _TRACE:
+                utrace.event(utrace.EV_STEP, self._pc)
+                start = utrace.begin()
+            if profiler: line_pc, line_start = self._pc, time.ticks_us()
+            line_stripped = self._get_line(self._pc + 1).rstrip('\r\n')
+            if _TRACE_DEBUG: utrace.log(utrace.LOG_DEBUG, f"  EXECUTING: {repr(line_stripped)}")
             if line_stripped:
-                prev_wait_mode = self._wait_mode
                 self._process_line(line_stripped)
-                if self._wait_mode != prev_wait_mode:
-                    print(f"    -> WAIT_MODE CHANGED TO: '{self._wait_mode}'")
-            
-            if self._wait_mode == 'none':
+            if self._wait_mode == _WAIT_NONE:
                 self._pc += 1
-        else:
-            self.stop()
+            budget -= 1
+            if profiler: profiler.record(line_pc, time.ticks_diff(time.ticks_us(), line_start))
+            if self.music_player.refill_pending(): self.music_player.poll() # 批量执行较久时不让 BGM 缓冲见底
+            if _TRACE: utrace.end(utrace.SPAN_STEP, start)
+        self._batching = False
+        if _TRACE: utrace.event(utrace.EV_WAIT, self._wait_mode)
+        if self._skip_mode:
+            # 快进时按固定间隔刷新，其余帧的画面变化留到下一次刷新
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self._skip_frame_ms) < _SKIP_FRAME_MS: return
+            self._skip_frame_ms = now
+        if not (self._scene_dirty or self._display_dirty): return
+        if profiler: flush_start = time.ticks_us()
+        if self._scene_dirty:
+            self._redraw_scene()
+            self._display_dirty = True
+        if self._display_dirty:
+            self._display_dirty = False
+            self._flush()
+        if profiler: profiler.record_flush(time.ticks_diff(time.ticks_us(), flush_start)) # 合并刷新单独计时，不算到批次中的某一行上
+
+    def _show(self):
+        """批量执行期间只标记需要刷新，由 _run_until_wait 结束时统一 show。"""
+        if self._batching: self._display_dirty = True
+        else: self._flush()
+
+    def _flush(self):
+        if _TRACE: start = utrace.begin()
+        self.display.show()
+        if _TRACE: utrace.end(utrace.SPAN_FLUSH, start)
+
+    def _lookahead_step(self):
+        """
+        空闲时向后扫描一行脚本，遇到 ^BG/^CG 就把对应数据块预取进共享缓存，
+        遇到 ^BGM 就让播放器提前装好该乐曲，执行到时只需切换。
+        跟随 ^JUMP，遇到 ^CHOICE/^END 时停止 (之后的流程无法静态确定)。
+        使用自己的预读窗口和索引游标，执行继续读下一行时不必重新 seek。
+        """
+        if self._lookahead_left <= 0: return
+        self._lookahead_left -= 1
+        if self._lookahead_pc >= self._total_lines:
+            self._lookahead_left = 0; return
+        line = self._get_line(self._lookahead_pc + 1, self._lookahead_window)
+        self._lookahead_pc += 1
+        if not line.startswith('^'): return
+        parts = line.split()
+        command = parts[0].upper()
+        try:
+            if command == '^BG': self.bg_reader.prefetch(int(parts[1]))
+            elif command == '^CG': self.cg_reader.prefetch(int(parts[2]))
+            elif command == '^BGM':
+                if self.sound_enabled: self.music_player.cue(parts[1], loop=True)
+            elif command == '^JUMP': self._lookahead_pc = int(parts[1]) - 1
+            elif command == '^CHOICE' or command == '^END': self._lookahead_left = 0
+        except (IndexError, ValueError): pass
 
     def _execute_sidebar_action(self):
         action = self.sidebar_options[self.sidebar_selection]
@@ -195,12 +502,21 @@ class ScriptEngine:
         elif "Auto" in action:
             self._auto_mode = not self._auto_mode
             print(f"自动模式: {'开启' if self._auto_mode else '关闭'}")
-            self._wait_mode = 'none' # [FIX] 读档成功后退出菜单
+            self._wait_mode = _WAIT_NONE # [FIX] 读档成功后退出菜单
+            self._redraw_scene();
+            self._draw_sidebar()
+        elif "Skip" in action:
+            self._auto_mode = False
+            self._skip_mode = True
+            self._skip_start_ms = self._skip_frame_ms = time.ticks_ms()
+            self._skip_lines = 0
+            print("快进: 开始跳过已读内容。")
+            self._wait_mode = _WAIT_NONE # 关闭菜单，回到剧本中开始快进
             self._redraw_scene();
             self._draw_sidebar()
         elif "Q.Load" in action:
             if self.load_state(): # 读档成功
-                self._wait_mode = 'none' # [FIX] 读档成功后退出菜单
+                self._wait_mode = _WAIT_NONE # [FIX] 读档成功后退出菜单
                 self._redraw_scene(); self._draw_sidebar() # [FIX] 刷新画面
                 # 这里不需要手动设置 _is_running = True，因为 load_state 已经做了
             else:
@@ -209,26 +525,30 @@ class ScriptEngine:
         elif "HOME" in action:
             self.stop() # stop 会将 _is_running 设为 False，回到标题界面
         elif "返回" in action:
-            self._wait_mode = 'none'
+            self._wait_mode = _WAIT_NONE
             self._redraw_scene(); self._draw_sidebar()
 
     def _draw_sidebar(self):
         self.display.fill_rect(0, 16, 32, 48, 0)
-        if self._wait_mode == 'menu':
-            y_coords = [16, 24, 32, 40, 48]
+        if self._wait_mode == _WAIT_BACKLOG:
+            self.font.text(self.display, "BackLog", 2, 28)
+            self.font.text(self.display, f"{self._backlog_cursor}/{self._backlog_count - 1}", 4, 40)
+        elif self._wait_mode == _WAIT_MENU:
             for i, option in enumerate(self.sidebar_options):
                 text_to_draw = "  AUTO  " if "Auto" in option and self._auto_mode else option
                 is_selected = (i == self.sidebar_selection)
-                self.font.text(self.display, text_to_draw, 0, y_coords[i], r=is_selected)
+                self.font.text(self.display, text_to_draw, 0, 16 + 8 * i, r=is_selected)
         else:
-            month_str = self._month_map.get(self._game_date['month'], "???")
+            month = self._month
+            month_str = _MONTH_NAMES[month] if 1 <= month <= 12 else _MONTH_NAMES[0]
             self.font.text(self.display, month_str, 2, 28)
-            day_str = f"{self._game_date['day']:02d}"
+            day_str = f"{self._day:02d}"
             self.font.text(self.display, day_str, 8, 36)
-            dow_str = self._day_map.get(self._game_date['dow'], '???')
+            dow_str = _DAY_NAMES[self._dow] if self._dow < 7 else '???'
             self.font.text(self.display, dow_str, 12, 44)
-            self.font.text(self.display, "Auto: ON" if self._auto_mode else "Auto:OFF", 0, 56)
-        self.display.show()
+            mode_str = "  SKIP  " if self._skip_mode else ("Auto: ON" if self._auto_mode else "Auto:OFF")
+            self.font.text(self.display, mode_str, 0, 56)
+        self._show()
 
     def _process_line(self, line):
         if not line.startswith('^'): self._handle_dialogue(line)
@@ -238,15 +558,15 @@ class ScriptEngine:
             if command == '^BG': self._handle_bg(parts)
             elif command == '^CG': self._handle_cg(parts)
             elif command == '^BGM': self._handle_bgm(parts)
-            elif command == '^BGMSTOP': self.music_player.stop(); self._screen_state['bgm_idx'] = 65535
+            elif command == '^BGMSTOP': self.music_player.stop(); self._bgm_idx = _NO_ASSET
             elif command == '^JUMP': self._pc = int(parts[1]) - 1
             elif command == '^CHOICE': self._handle_choice(line)
             elif command == '^END': self.stop()
             elif command == '^D':
                 date_str = parts[1]
-                self._game_date['month'] = int(date_str[0:2])
-                self._game_date['day'] = int(date_str[2:4])
-                self._game_date['dow'] = int(date_str[4])
+                self._month = int(date_str[0:2])
+                self._day = int(date_str[2:4])
+                self._dow = int(date_str[4])
                 self._draw_sidebar()
 
     def _handle_dialogue(self, line: str):
@@ -254,48 +574,159 @@ class ScriptEngine:
             print(f"警告: 无效的对话行 (缺少冒号): '{line}'")
             return
 
-        speaker, content_raw = line.split(':', 1)
-        content_processed = content_raw.replace('\\n', '\n')
-        self.display.fill_rect(0, 0, 128, 16, 0)
-        self.font.text(self.display, speaker, 0, 16, r=1)
-        self.font.text(self.display, content_processed, 0, 0)
-        self.display.show()
+        pc = self._pc
+        self._backlog_push(pc)
+        if self._skip_mode:
+            if self._is_seen(pc):
+                # 已读: 不等待；只有本帧要刷新时才绘制文字
+                self._skip_lines += 1
+                if time.ticks_diff(time.ticks_ms(), self._skip_frame_ms) >= _SKIP_FRAME_MS:
+                    self._draw_dialogue(line)
+                return
+            self._stop_skip() # 遇到未读内容，停下来
+            self._draw_sidebar()
+        self._mark_seen(pc)
+        content_processed = self._draw_dialogue(line)
+        self._lookahead_pc = pc + 1
+        self._lookahead_left = _LOOKAHEAD_LINES
         if self._auto_mode:
             char_count = len(content_processed.replace('\n', ''))
             delay_ms = 500 + 300 * char_count
             self._auto_wait_until_ms = time.ticks_ms() + delay_ms
-            self._wait_mode = 'auto'
+            self._wait_mode = _WAIT_AUTO
         else:
-            self._wait_mode = 'confirm'
+            self._wait_mode = _WAIT_CONFIRM
 
-    def _redraw_scene(self):
-        bg_index = self._screen_state['bg']
-        if bg_index is not None:
-            bg_data = self.bg_reader.read_chunk(bg_index)
-            if bg_data: draw_image(self.display, bg_data, 32, 16, 96, 48)
-        else: self.display.fill_rect(32, 16, 96, 48, 0)
-        for pos_key, x_coord in [('cg_l', 33), ('cg_c', 68), ('cg_r', 105)]:
-             cg_index = self._screen_state.get(pos_key)
-             if cg_index is not None:
+    def _draw_dialogue(self, line: str) -> str:
+        speaker, content_raw = line.split(':', 1)
+        content_processed = content_raw.replace('\\n', '\n')
+        if self._scene_dirty: self._redraw_scene() # 先画场景，避免覆盖说话人名字
+        self.display.fill_rect(0, 0, 128, 16, 0)
+        self.font.text(self.display, speaker, 0, 16, r=1)
+        self.font.text(self.display, content_processed, 0, 0)
+        self._show()
+        return content_processed
+
+    def _backlog_push(self, pc: int):
+        head = self._backlog_head
+        self._backlog_pc[head] = pc
+        scene, base = self._backlog_scene, 4 * head
+        scene[base] = self._bg
+        scene[base + 1], scene[base + 2], scene[base + 3] = self._cg[0], self._cg[1], self._cg[2]
+        self._backlog_head = (head + 1) % _BACKLOG_SIZE
+        if self._backlog_count < _BACKLOG_SIZE: self._backlog_count += 1
+
+    def _open_backlog(self):
+        if self._backlog_count < 2: return # 只有当前这一页
+        self._backlog_return_mode = self._wait_mode
+        self._wait_mode = _WAIT_BACKLOG
+        self._backlog_cursor = 0
+        self._backlog_step(1)
+
+    def _backlog_step(self, delta: int):
+        """cursor 为距最新一页的页数。按记录重新合成画面、经索引读取文字，不重新执行任何指令。"""
+        cursor = self._backlog_cursor + delta
+        if cursor <= 0:
+            self._close_backlog(); return
+        if cursor >= self._backlog_count: cursor = self._backlog_count - 1
+        self._backlog_cursor = cursor
+        entry = (self._backlog_head - 1 - cursor) % _BACKLOG_SIZE
+        scene, base = self._backlog_scene, 4 * entry
+        self._compose_scene(scene[base], scene, base + 1)
+        self._scene_valid = False # 快照中现在是回看的画面
+        self.display.blit(self._scene_fb, _SCENE_X, _SCENE_Y)
+        self._draw_dialogue(self._get_line(self._backlog_pc[entry] + 1).rstrip('\r\n'))
+        self._draw_sidebar()
+
+    def _close_backlog(self):
+        self._wait_mode = self._backlog_return_mode
+        self._redraw_scene()
+        line = self._get_line(self._pc + 1).rstrip('\r\n')
+        if ':' in line and not line.startswith('^'): self._draw_dialogue(line)
+        self._draw_sidebar()
+
+    def _is_seen(self, pc: int) -> bool:
+        seen = self._seen
+        return seen is not None and (seen[pc >> 3] >> (pc & 7)) & 1 == 1
+
+    def _mark_seen(self, pc: int):
+        seen = self._seen
+        if seen is None: return
+        mask = 1 << (pc & 7)
+        if not seen[pc >> 3] & mask:
+            seen[pc >> 3] |= mask
+            self._seen_dirty = True
+
+    def _stop_skip(self):
+        self._skip_mode = False
+        elapsed = time.ticks_diff(time.ticks_ms(), self._skip_start_ms)
+        print(f"快进: 跳过 {self._skip_lines} 行，用时 {elapsed} ms ({self._skip_lines * 1000 // max(1, elapsed)} 行/秒)。")
+
+    def _load_seen(self):
+        """读取已读位图；行数与当前脚本不符 (脚本重新编译过) 时从空白开始。"""
+        if not self._total_lines: return
+        self._seen = bytearray((self._total_lines + 7) // 8)
+        try:
+            with open(_SEEN_FILE, 'rb') as f:
+                magic, version, line_count = struct.unpack(_SEEN_HEADER_FORMAT, f.read(_SEEN_HEADER_SIZE))
+                if magic == _SEEN_MAGIC and version == _SEEN_VERSION and line_count == self._total_lines:
+                    f.readinto(self._seen)
+                else:
+                    print("已读记录与当前脚本不符，已重置。")
+        except (OSError, ValueError): pass
+
+    def _save_seen(self):
+        """只在有新的已读行时写入，且只在存档和离开游戏时调用，避免频繁擦写 Flash。"""
+        if not self._seen_dirty: return
+        try:
+            with open(_SEEN_FILE, 'wb') as f:
+                f.write(struct.pack(_SEEN_HEADER_FORMAT, _SEEN_MAGIC, _SEEN_VERSION, self._total_lines))
+                f.write(self._seen)
+            self._seen_dirty = False
+        except OSError as e:
+            print(f"已读记录写入失败: {e}")
+
+    def _compose_scene(self, bg_index: int, cgs, base: int = 0):
+        """
+        把背景和立绘合成到场景快照中 (唯一会读取 BG/CG 数据块的地方)。
+        cgs[base:base + 3] 为左/中/右立绘索引，回看时直接传入环形缓冲中的记录。
+        """
+        bg_data = self.bg_reader.read_chunk(bg_index) if bg_index != _NO_ASSET else None
+        # 背景与快照同为 96x48 MONO_HLSB，直接整块拷贝
+        if bg_data: self._scene_buf[:] = bg_data
+        else: self._scene_fb.fill(0)
+        for pos in range(3):
+             cg_index = cgs[base + pos]
+             if cg_index != _NO_ASSET:
                  cg_data = self.cg_reader.read_chunk(cg_index)
-                 if cg_data: draw_image(self.display, cg_data, x_coord, 16, 24, 48)
+                 if cg_data: draw_image(self._scene_fb, cg_data, _CG_X[pos], 0, 24, 48)
+
+    def _redraw_scene(self):
+        if _TRACE: start = utrace.begin()
+        self._scene_dirty = False
+        if not self._scene_valid:
+            if _TRACE: utrace.event(utrace.EV_SCENE, self._bg)
+            self._compose_scene(self._bg, self._cg)
+            self._scene_valid = True
+        self.display.blit(self._scene_fb, _SCENE_X, _SCENE_Y)
+        if _TRACE: utrace.end(utrace.SPAN_RENDER, start)
 
     def _handle_bg(self, parts: list):
         try:
-            self._screen_state['bg'] = int(parts[1])
-            self._screen_state['cg_l'] = self._screen_state['cg_c'] = self._screen_state['cg_r'] = None
-            self._redraw_scene()
-            self.display.show()
+            self._bg = int(parts[1])
+            self._cg[0] = self._cg[1] = self._cg[2] = _NO_ASSET
+            self._scene_valid = False
+            self._scene_dirty = True
         except (IndexError, ValueError): pass
 
     def _handle_cg(self, parts: list):
         try:
             pos_char, cg_index = parts[1], int(parts[2])
-            state_key = {'l': 'cg_l', 'c': 'cg_c', 'r': 'cg_r'}.get(pos_char)
-            if state_key:
-                self._screen_state[state_key] = cg_index
-                self._redraw_scene()
-                self.display.show()
+            pos = _CG_POS_CHARS.find(pos_char) if len(pos_char) == 1 else -1
+            if pos >= 0:
+                self._cg[pos] = cg_index
+                self._scene_valid = False
+                self._scene_dirty = True
         except (IndexError, ValueError): pass
 
     def _handle_bgm(self, parts: list):
@@ -303,7 +734,7 @@ class ScriptEngine:
             bgm_index_str = parts[1]
             # --- [关键修正] ---
             # 将字符串索引转换为整数后再存入状态
-            self._screen_state['bgm_idx'] = int(bgm_index_str)
+            self._bgm_idx = int(bgm_index_str)
             if self.sound_enabled:
                 self.music_player.play(bgm_index_str, loop=True)
         except (IndexError, ValueError):
@@ -338,8 +769,9 @@ class ScriptEngine:
             except (ValueError, IndexError): continue
 
         if self._choice_options:
+            if self._skip_mode: self._stop_skip(); self._draw_sidebar()
             self._selected_choice = 0
-            self._wait_mode = 'choice'
+            self._wait_mode = _WAIT_CHOICE
             self._draw_choices()
 
     def _draw_single_choice(self, index: int, is_selected: bool):
@@ -369,88 +801,68 @@ class ScriptEngine:
             self.display.rect(_CHOICE_BOX_X, y_positions[i], _CHOICE_BOX_W, _CHOICE_BOX_H, 1)
             self._draw_single_choice(i, i == self._selected_choice)
             
-        self.display.show()
+        self._show()
 
     def _play_feedback_sound(self):
         if self.sound_enabled:
             self.music_player.play_sfx([(262, 150), (330, 150), (392, 150)])
 
-    def save_state(self):
+    def save_state(self, slot=_QUICK_SLOT):
         print("正在快速存档...")
+        self._save_seen()
         try:
-            # --- [FIX] 确保所有待打包的值都是整数 ---
-            
-            pc = self._pc
-            month, day, dow = self._game_date['month'], self._game_date['day'], self._game_date['dow']
-
-            # 对于每个可能为 None 的状态值，进行检查和转换
-            # 如果值是 None，就使用 65535 作为默认值，否则使用原值。
-            bgm_idx = self._screen_state['bgm_idx'] if self._screen_state.get('bgm_idx') is not None else 65535
-            bg_idx = self._screen_state['bg'] if self._screen_state.get('bg') is not None else 65535
-            cgl_idx = self._screen_state['cg_l'] if self._screen_state.get('cg_l') is not None else 65535
-            cgc_idx = self._screen_state['cg_c'] if self._screen_state.get('cg_c') is not None else 65535
-            cgr_idx = self._screen_state['cg_r'] if self._screen_state.get('cg_r') is not None else 65535
-            
-            # 使用修正后的整数值进行打包
-            int_payload = struct.pack(self._save_format_ints, pc, bgm_idx, month, day, dow, bg_idx, cgl_idx, cgc_idx, cgr_idx)
-            crc = ucrc32.ucrc32(int_payload)
-            data_to_write = int_payload + struct.pack('<I', crc)
-            
-            try:
-                os.stat('save.dat'); os.rename('save.dat', 'save.bak')
-            except OSError: pass
-            
-            with open('save.dat', 'wb') as f: f.write(data_to_write)
-            
+            # 空位置在内存中就以 65535 (_NO_ASSET) 表示，可直接打包
+            cg = self._cg
+            payload = struct.pack(_SAVE_FORMAT_INTS, self._pc, self._bgm_idx, self._month, self._day, self._dow,
+                                  self._bg, cg[0], cg[1], cg[2])
+            self.save_store.save(slot, payload)
             print("存档成功！"); self._play_feedback_sound()
         except Exception as e:
             print(f"存档写入失败: {e}")
 
-    def load_state(self, from_title_menu=False):
+    def load_state(self, from_title_menu=False, slot=_QUICK_SLOT):
         if from_title_menu:
             # 从标题菜单调用时，只设置一个等待模式
             # 并确保引擎处于“运行”状态，以便 update 函数能被执行
             print("读档请求已接收，将在下一帧执行。")
             self._is_running = True
-            self._wait_mode = 'pending_load' # 新的等待模式
+            self._wait_mode = _WAIT_PENDING_LOAD # 新的等待模式
             return True
         print("正在快速读档...")
         try:
-            SAVE_FORMAT_INTS = '<IHBBBHHHH'
-            CRC_FORMAT = '<I'
-            SAVE_SIZE = struct.calcsize(SAVE_FORMAT_INTS) + struct.calcsize(CRC_FORMAT)
-
-            with open('save.dat', 'rb') as f: data = f.read()
-            if len(data) != SAVE_SIZE: raise ValueError("存档文件大小错误")
-            
-            int_payload = data[:struct.calcsize(SAVE_FORMAT_INTS)]
-            saved_crc_bytes = data[struct.calcsize(SAVE_FORMAT_INTS):]
-            saved_crc = struct.unpack('<I', saved_crc_bytes)[0]
-            if saved_crc != ucrc32.ucrc32(int_payload): raise ValueError("存档校验和错误")
+            # 日志中每条记录都带 CRC，load() 只返回校验通过的最新记录
+            payload = self.save_store.load(slot)
+            if payload is None: raise ValueError(f"槽位 {slot} 没有有效存档")
             
-            pc, bgm_idx, m, d, dow, bg_idx, cgl_idx, cgc_idx, cgr_idx = struct.unpack(SAVE_FORMAT_INTS, int_payload)
-            if not all(idx == 65535 or (reader and idx < len(reader)) for idx, reader in 
+            pc, bgm_idx, m, d, dow, bg_idx, cgl_idx, cgc_idx, cgr_idx = struct.unpack(_SAVE_FORMAT_INTS, payload)
+            if not all(idx == _NO_ASSET or (reader and idx < len(reader)) for idx, reader in 
                        [(bg_idx, self.bg_reader), (cgl_idx, self.cg_reader), 
                         (cgc_idx, self.cg_reader), (cgr_idx, self.cg_reader)]):
                  raise ValueError("存档资源索引越界")
+            if pc >= self._total_lines: raise ValueError("存档行号越界")
+            if self._keyframes:
+                # 存档时 PC 所在的行已经执行过，对照的是执行完该行之后的推算状态
+                saved = [bgm_idx, m, d, dow, bg_idx, cgl_idx, cgc_idx, cgr_idx]
+                expected = self._state_at(pc + 1)
+                if saved != expected:
+                    print(f"警告: 存档状态 {saved} 与关键帧推算 {expected} 不一致 (经过跳转或选项时可能出现)。")
 
             self._pc = pc
-            self._game_date = {'month': m, 'day': d, 'dow': dow}
-            current_bgm_idx = bgm_idx if bgm_idx != 65535 else None
-            self._screen_state['bgm_idx'] = current_bgm_idx
-            self._screen_state['bg'] = bg_idx if bg_idx != 65535 else None
-            self._screen_state['cg_l'] = cgl_idx if cgl_idx != 65535 else None
-            self._screen_state['cg_c'] = cgc_idx if cgc_idx != 65535 else None
-            self._screen_state['cg_r'] = cgr_idx if cgr_idx != 65535 else None
+            self._backlog_count = 0 # 读档后之前的回看记录不再属于当前流程
+            self._month, self._day, self._dow = m, d, dow
+            self._bgm_idx = bgm_idx
+            self._bg = bg_idx
+            self._cg[0], self._cg[1], self._cg[2] = cgl_idx, cgc_idx, cgr_idx
+            self._scene_valid = False
             
-            if current_bgm_idx is not None and self.sound_enabled:
-                music_name = f"{current_bgm_idx:02d}"
+            if bgm_idx != _NO_ASSET and self.sound_enabled:
+                music_name = f"{bgm_idx:02d}"
                 self.music_player.play(music_name, loop=True)
             else:
                 self.music_player.stop()
 
             self._is_running = True    # 1. 标记引擎为运行状态
-            self._wait_mode = 'none'   # 2. 确保游戏可以立即开始执行
+            self._wait_mode = _WAIT_NONE   # 2. 确保游戏可以立即开始执行
             
             self._redraw_scene()       # 3. 刷新画面
             self._draw_sidebar()
@@ -459,7 +871,7 @@ class ScriptEngine:
             
             # --- [FIX] 读档成功后，进入等待确认模式 ---
             # 这会阻止 update() 在同一帧内立即执行下一行脚本
-            self._wait_mode = 'confirm' 
+            self._wait_mode = _WAIT_CONFIRM 
             
             return True
         except Exception as e:
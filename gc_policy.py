@@ -0,0 +1,69 @@
+# gc_policy.py
+# 描述: 主循环的垃圾回收策略与按界面模式的内存统计。
+#   POLICY_THRESHOLD: 由 gc.threshold 按分配量自动回收，另外在空闲等待时顺手回收。
+#   POLICY_BUDGET   : 关闭自动阈值，只在空闲等待时回收；空闲堆低于硬性下限时立即回收，
+#                     保证忙碌的帧 (OP 播放、脚本批量执行) 不会被一次完整回收打断。
+#   两种策略都按 WELCOME/TITLE/OP/GAME/CHAPTER 统计每帧分配的字节数和最低空闲堆，
+#   用于确认热路径没有分配内存。
+import gc
+import time
+from micropython import const
+
+POLICY_THRESHOLD = const(0)
+POLICY_BUDGET = const(1)
+
+MODE_NAMES = ('WELCOME', 'TITLE', 'OP', 'GAME', 'CHAPTER') # 下标与 main.py 的 MODE_* 一致
+
+class GCPolicy:
+    def __init__(self, policy=POLICY_THRESHOLD, threshold_bytes=16 * 1024, idle_min_bytes=2 * 1024, floor_bytes=24 * 1024):
+        self.policy = policy
+        self._idle_min = idle_min_bytes # 空闲时至少积累这么多分配才值得回收
+        self._floor = floor_bytes       # 空闲堆的硬性下限
+        count = len(MODE_NAMES)
+        self.ticks = [0] * count
+        self.alloc_bytes = [0] * count
+        self.max_tick_alloc = [0] * count
+        self.min_free = [0x7FFFFFFF] * count
+        self.collections = 0
+        self.collect_us = 0
+        self.max_collect_us = 0
+        self._tick_mode = 0
+        self._tick_start = 0
+        self._since_collect = 0
+        gc.threshold(threshold_bytes if policy == POLICY_THRESHOLD else -1)
+        self.collect()
+
+    def begin_tick(self, mode):
+        self._tick_mode = mode
+        self._tick_start = gc.mem_alloc()
+
+    def end_tick(self, idle):
+        """记录本帧的分配量，并按策略决定是否回收。idle 表示当前停在等待输入的状态。"""
+        mode = self._tick_mode
+        allocated = gc.mem_alloc() - self._tick_start
+        if allocated < 0: allocated = 0 # 本帧内发生过自动回收，无法精确计量
+        self.ticks[mode] += 1
+        self.alloc_bytes[mode] += allocated
+        if allocated > self.max_tick_alloc[mode]: self.max_tick_alloc[mode] = allocated
+        free = gc.mem_free()
+        if free < self.min_free[mode]: self.min_free[mode] = free
+        self._since_collect += allocated
+        if free < self._floor or (idle and self._since_collect >= self._idle_min):
+            self.collect()
+
+    def collect(self):
+        start = time.ticks_us()
+        gc.collect()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self.collections += 1
+        self.collect_us += elapsed
+        if elapsed > self.max_collect_us: self.max_collect_us = elapsed
+        self._since_collect = 0
+
+    def report(self):
+        print(f"垃圾回收: {self.collections} 次，共 {self.collect_us // 1000} ms，最长 {self.max_collect_us} us。")
+        for mode, name in enumerate(MODE_NAMES):
+            ticks = self.ticks[mode]
+            if not ticks: continue
+            print(f"  {name:<7} {ticks} 帧，平均分配 {self.alloc_bytes[mode] // ticks} 字节/帧，"
+                  f"单帧最多 {self.max_tick_alloc[mode]} 字节，最低空闲堆 {self.min_free[mode]} 字节")
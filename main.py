@@ -8,11 +8,16 @@ import re
 import os
 import struct
 import ucrc32
-from data_reader import DataReader
-from buzzer_player import SongPlayer
+from save_store import SaveStore
+from data_reader import DataReader, ChunkCache
+from pack_reader import PackReader
+from buzzer_player import SongPlayer, SCHED_PERIODIC, SCHED_ONESHOT
 from cg_player import CGPlayer
 from buttons import Button
 from engine import ScriptEngine
+from gc_policy import GCPolicy, POLICY_THRESHOLD, POLICY_BUDGET
+import utrace
+from script_profile import ScriptProfiler
 from utils import draw_image, draw_rect
 Pin(8,Pin.OUT).value(0)
 # =============================================================================
@@ -21,7 +26,16 @@ Pin(8,Pin.OUT).value(0)
 print("正在初始化硬件...")
 i2c = I2C(0, scl=Pin(7), sda=Pin(6),freq=400000)
 display = ssd1306.SSD1306_I2C(128, 64, i2c)
-font = ufont.BMFont("1.bmf")
+# 优先使用单文件资源包 (trpak.py 生成)，不存在时回退到散落的资源文件
+ASSET_PACK = '/assets.pak'
+try:
+    asset_pack = PackReader(ASSET_PACK)
+    asset_opener = asset_pack.open
+except (OSError, ValueError) as e:
+    print(f"未使用资源包 ({e})，将直接读取各资源文件。")
+    asset_pack = None
+    asset_opener = open
+font = ufont.BMFont("1.bmf", opener=asset_opener if asset_pack else None)
 print("正在显示欢迎界面...")
 display.fill(0)
 font.text(display, "Re2:再次从零开始的AIRESP32C6移植", cx=0, cy=0, r=1)
@@ -36,54 +50,66 @@ gc.collect()
 # =============================================================================
 # 2. 存档系统检查
 # =============================================================================
+SAVE_JOURNAL = 'save.jnl'
+SAVE_PAYLOAD_SIZE = const(17) # 与 engine.py 的 _SAVE_FORMAT_INTS 相同
+SAVE_SLOTS = const(4)
+SAVE_JOURNAL_RECORDS = const(32) # 预分配记录数，32 x 32 字节
+
 def check_and_init_save():
-    """检查存档完整性，并在必要时创建或恢复。"""
-    SAVE_FILE = 'save.dat'; BACKUP_FILE = 'save.bak'
-    
-    SAVE_FORMAT_INTS = '<IHBBBHHHH'
-    CRC_FORMAT = '<I'
-    SAVE_SIZE = struct.calcsize(SAVE_FORMAT_INTS) + struct.calcsize(CRC_FORMAT)
+    """扫描存档日志；日志为空时迁移旧版 save.dat/save.bak，都没有则写入一条空白存档。"""
+    store = SaveStore(SAVE_JOURNAL, SAVE_PAYLOAD_SIZE, slots=SAVE_SLOTS, capacity=SAVE_JOURNAL_RECORDS)
+    try:
+        found = store.open()
+    except OSError as e:
+        print(f"存档日志打开失败: {e}")
+        return store
+    if not store.is_empty():
+        print(f"存档日志正常: {found} 条有效记录。")
+        return store
 
-    def is_valid(filepath):
+    def read_legacy(filepath):
         try:
             with open(filepath, 'rb') as f: data = f.read()
-            if len(data) != SAVE_SIZE: return False
-            
-            int_payload = data[:struct.calcsize(SAVE_FORMAT_INTS)]
-            saved_crc_bytes = data[struct.calcsize(SAVE_FORMAT_INTS):]
-            
-            saved_crc = struct.unpack('<I', saved_crc_bytes)[0]
-            return saved_crc == ucrc32.ucrc32(int_payload)
-        except:
-            return False
-
-    if not is_valid(SAVE_FILE):
-        print(f"'{SAVE_FILE}' 损坏或不存在。正在检查备份...")
-        if is_valid(BACKUP_FILE):
-            print("备份文件正常，正在从备份恢复...")
-            try:
-                with open(BACKUP_FILE, 'rb') as f_bak, open(SAVE_FILE, 'wb') as f_sav:
-                    f_sav.write(f_bak.read())
-                print("恢复成功！")
-            except Exception as e:
-                print(f"从备份恢复失败: {e}")
+            if len(data) != SAVE_PAYLOAD_SIZE + 4: return None
+            payload = data[:SAVE_PAYLOAD_SIZE]
+            saved_crc = struct.unpack('<I', data[SAVE_PAYLOAD_SIZE:])[0]
+            return payload if saved_crc == ucrc32.ucrc32(payload) else None
+        except OSError:
+            return None
+
+    payload = read_legacy('save.dat') or read_legacy('save.bak')
+    try:
+        if payload:
+            print("发现旧版存档，正在迁移到存档日志...")
+            store.save(0, payload)
+            for filepath in ('save.dat', 'save.bak'):
+                try: os.remove(filepath)
+                except OSError: pass
         else:
-            print("备份文件也异常。正在创建新的空白存档...")
-            try:
-                # --- 核心修正：使用完全展开后的格式打包 ---
-                initial_payload = struct.pack(SAVE_FORMAT_INTS, 0, 65535, 7, 17, 1, 65535, 65535, 65535, 65535)
-                crc = ucrc32.ucrc32(initial_payload)
-                with open(SAVE_FILE, 'wb') as f:
-                    f.write(initial_payload + struct.pack('<I', crc))
-                print("新存档创建成功。")
-            except Exception as e:
-                print(f"创建新存档失败: {e}")
-
-check_and_init_save()
+            print("没有可用的存档，正在创建新的空白存档...")
+            store.save(0, struct.pack('<IHBBBHHHH', 0, 65535, 7, 17, 1, 65535, 65535, 65535, 65535))
+        print("存档初始化成功。")
+    except Exception as e:
+        print(f"存档初始化失败: {e}")
+    return store
+
+save_store = check_and_init_save()
 
 # --- 按钮状态初始化 ---
 DEBOUNCE_MS = const(20)
 LONG_PRESS_MS = const(500)
+CHUNK_CACHE_BYTES = const(8 * 1024) # BG/CG/OP 共享的数据块缓存预算
+SCRIPT_INDEX_PAGED = False # 紧凑脚本索引只保留检查点常驻，差分按页读取
+SCRIPT_PROFILE = False # 按脚本行统计执行次数和耗时，回到标题时导出到 PROFILE_FILE
+SCRIPT_PROFILE_SHIFT = const(2) # 每 4 行合并为一个统计桶
+PROFILE_FILE = 'profile.bin'
+DEBUG_START_LINE = -1 # >= 0 时长按确认后跳过标题和 OP，直接从该行 (从 0 开始) 进入游戏
+GC_POLICY = POLICY_THRESHOLD # POLICY_BUDGET: 只在空闲等待时回收，空闲堆低于下限时才强制回收
+AUDIO_SCHEDULER = SCHED_PERIODIC # SCHED_ONESHOT: 只在下一个音符/包络事件时触发定时器中断
+AUDIO_BUFFER_NOTES = const(64) # 每个声道每个半区的音符数 (两个 deck x 两个声道 x 两个半区 x 24 字节)
+AUDIO_LOW_WATER = const(16) # 当前半区剩余音符少于此数而另一半未填好时请求补充
+AUDIO_REFILL_THREAD = False # 用 _thread 补充线程填充音频缓冲，不再依赖主循环调用 poll()
+_TRACE = const(1) # 主循环各阶段的耗时埋点 (编译期常量，为 0 时埋点代码被整段去除)
 
 # inverted=False 因为 PULL_DOWN 时，按下是高电平
 btn_confirm = Button(pin_id=15, pull=Pin.PULL_DOWN, inverted=False, debounce_ms=DEBOUNCE_MS, long_press_ms=LONG_PRESS_MS)
@@ -96,14 +122,22 @@ btn_menu = Button(pin_id=20, pull=Pin.PULL_DOWN, inverted=False, debounce_ms=DEB
 print("正在预加载核心模块...")
 if 1:
     # --- 核心修正：不再加载和使用 assets_manifest.json ---
-    bg_reader = DataReader('/bg.dat', 96 * 48 // 8)
-    cg_reader = DataReader('/cg.dat', 24 * 48 // 8)
-    op_reader = DataReader('/op.dat', 96 * 48 // 8)
+    chunk_cache = ChunkCache(CHUNK_CACHE_BYTES)
+    bg_reader = DataReader('/bg.dat', 96 * 48 // 8, cache=chunk_cache, opener=asset_opener)
+    cg_reader = DataReader('/cg.dat', 24 * 48 // 8, cache=chunk_cache, opener=asset_opener)
+    op_reader = DataReader('/op.dat', 96 * 48 // 8, cache=chunk_cache, opener=asset_opener)
     
-    music_player = SongPlayer(pin0=0, pin1=3)
+    # 资源包的子文件共用一个文件句柄 (先 seek 再读)，补充线程必须另开一个资源包，不能与主线程交错读取
+    audio_opener = PackReader(ASSET_PACK).open if AUDIO_REFILL_THREAD and asset_pack else asset_opener
+    music_player = SongPlayer(pin0=0, pin1=3, opener=audio_opener, scheduler=AUDIO_SCHEDULER,
+                              buffer_notes=AUDIO_BUFFER_NOTES, low_water=AUDIO_LOW_WATER)
+    if AUDIO_REFILL_THREAD and not music_player.start_refill_thread():
+        print("警告: 固件不支持 _thread，音频缓冲仍由主循环补充。")
     op_player = CGPlayer(display, font, music_player=music_player, image_reader=op_reader)
     # --- 核心修正：不再传递 config 给 ScriptEngine ---
-    game_engine = ScriptEngine(display, font, music_player, bg_reader, cg_reader)
+    game_engine = ScriptEngine(display, font, music_player, bg_reader, cg_reader, opener=asset_opener, index_paged=SCRIPT_INDEX_PAGED, save_store=save_store)
+    if SCRIPT_PROFILE:
+        game_engine.profiler = ScriptProfiler(game_engine.line_count(), SCRIPT_PROFILE_SHIFT)
     
     gc.collect() # 尽早回收内存
     
@@ -112,11 +146,14 @@ if 1:
 # =============================================================================
 # 4. 进入主循环
 # =============================================================================
-MODE_WELCOME = 0; MODE_TITLE = 1; MODE_OP = 2; MODE_GAME = 3
+MODE_WELCOME = 0; MODE_TITLE = 1; MODE_OP = 2; MODE_GAME = 3; MODE_CHAPTER = 4
 current_mode = MODE_WELCOME
 
 title_selection = 0
 title_options = ["从头开始", "读取存档", "声音", "—重置—"]
+if game_engine.chapters(): title_options.insert(2, "章节选择") # 需要 trsc.py 生成的关键帧表
+chapter_selection = 0
+CHAPTER_ROWS = const(5)
 sound_enabled = True
 
 def draw_title_menu():
@@ -131,7 +168,7 @@ def draw_title_menu():
     font.text(display, "Summer stretches on endlessly.", 4, 0)
     font.text(display, "BeneathTheAirInWhichSheAwaits.", 4, 8)
     
-    y_coords = [18, 28, 38, 48]
+    y_coords = [18, 28, 38, 48] if len(title_options) <= 4 else [16, 25, 34, 43, 52]
     for i, option in enumerate(title_options):
         text_to_draw = option
         if "声音" in option:
@@ -142,52 +179,85 @@ def draw_title_menu():
             
     display.show()
 
+def draw_chapter_menu():
+    """绘制章节选择界面，选中项所在的一页最多显示 CHAPTER_ROWS 个章节。"""
+    display.fill(0)
+    chapters = game_engine.chapters()
+    font.text(display, f"章节选择  {chapter_selection + 1}/{len(chapters)}", 0, 0, r=1)
+    first = chapter_selection - chapter_selection % CHAPTER_ROWS
+    for row, (name, _) in enumerate(chapters[first:first + CHAPTER_ROWS]):
+        font.text(display, name, 2, 16 + 9 * row, r=(first + row == chapter_selection))
+    display.show()
+
 print("进入主循环...")
 loop_counter = 0
+gc_policy = GCPolicy(GC_POLICY)
 while True:
+    gc_policy.begin_tick(current_mode)
     # B. 统一更新输入
+    if _TRACE: span_start = utrace.begin()
     btn_confirm.update()
     btn_next.update()
     btn_menu.update()
+    if _TRACE: utrace.end(utrace.SPAN_INPUT, span_start)
     
     if current_mode == MODE_WELCOME:
         if btn_confirm.was_long_pressed():
-            print("欢迎界面已确认，切换到标题模式。")
-            current_mode = MODE_TITLE
-            title_selection = 0
-            draw_title_menu()
+            if DEBUG_START_LINE >= 0:
+                current_mode = MODE_GAME
+                game_engine.start(DEBUG_START_LINE)
+            else:
+                print("欢迎界面已确认，切换到标题模式。")
+                current_mode = MODE_TITLE
+                title_selection = 0
+                draw_title_menu()
 
 
             
     elif current_mode == MODE_TITLE:
         redraw_menu = False
+        if btn_menu.was_long_pressed(): # 长按菜单键: 输出埋点数据和内存统计
+            if _TRACE: utrace.dump()
+            gc_policy.report()
+            st = music_player.stats()
+            print(f"音频中断: {st['isr_count']} 次，平均 {st['isr_avg_us']} us，最长 {st['isr_max_us']} us；"
+                  f"{st['onsets']} 个音符起始延迟平均 {st['late_avg_us']} us，最大 {st['late_max_us']} us")
+            print(f"音频缓冲: {st['buffer_notes']} 音符/半区，水位 {st['low_water']}；欠载 {st['underruns']} 次，"
+                  f"补充 {st['refills']} 次，最长补充延迟 {st['max_refill_us']} us，最大定时器抖动 {st['max_jitter_us']} us")
         if btn_next.was_pressed():
             title_selection = (title_selection + 1) % len(title_options)
             redraw_menu = True
         
         if btn_confirm.was_pressed():
-            if title_selection == 0: # 从头开始
+            option = title_options[title_selection]
+            if option == "从头开始":
                 current_mode = MODE_OP
                 op_player.play()
                 time.sleep_ms(100) # [FIX] 添加短延迟
-            elif title_selection == 1: # 读取存档
+            elif option == "读取存档":
                 # --- [NEW] 新的调用方式 ---
                 if game_engine.load_state(from_title_menu=True):
                     current_mode = MODE_GAME
                 else: 
                     redraw_menu = True
                 time.sleep_ms(100) # [FIX] 添加短延迟
-            elif title_selection == 2: # 声音
+            elif option == "章节选择":
+                current_mode = MODE_CHAPTER
+                chapter_selection = 0
+                draw_chapter_menu()
+                time.sleep_ms(100)
+            elif option == "声音":
                 sound_enabled = not sound_enabled
                 game_engine.sound_enabled = sound_enabled
                 if not sound_enabled: music_player.stop()
                 redraw_menu = True
                 time.sleep_ms(100) # [FIX] 添加短延迟
-            elif title_selection == 3: # 重置
+            elif option == "—重置—":
                 print("正在重置存档并重启...")
-                try: os.remove('save.dat')
-                except OSError: pass
-                try: os.remove('save.bak')
+                for filepath in (SAVE_JOURNAL, 'save.dat', 'save.bak'):
+                    try: os.remove(filepath)
+                    except OSError: pass
+                try: os.remove('seen.dat')
                 except OSError: pass
                 display.clear(); font.text(display, "重置完成...", 0, 0, r=1); display.show()
                 time.sleep(1)
@@ -196,10 +266,26 @@ while True:
         if redraw_menu:
             draw_title_menu()
             time.sleep_ms(150) # 防止按键过快连发
+
+    elif current_mode == MODE_CHAPTER:
+        if btn_next.was_pressed():
+            chapter_selection = (chapter_selection + 1) % len(game_engine.chapters())
+            draw_chapter_menu()
+        elif btn_confirm.was_pressed():
+            name, line = game_engine.chapters()[chapter_selection]
+            print(f"章节选择: '{name}'。")
+            current_mode = MODE_GAME
+            display.fill(0)
+            game_engine.start(line)
+        elif btn_menu.was_pressed():
+            current_mode = MODE_TITLE
+            draw_title_menu()
             
     elif current_mode == MODE_OP:
         op_player.update()
+        if _TRACE: span_start = utrace.begin()
         music_player.poll()
+        if _TRACE: utrace.end(utrace.SPAN_AUDIO, span_start)
         if btn_confirm.was_pressed() or btn_next.was_pressed() or btn_menu.was_pressed():
             op_player.skip()
         if not op_player.is_playing():
@@ -207,25 +293,27 @@ while True:
             game_engine.start(0)
 
     elif current_mode == MODE_GAME:
-        # --- [关键修正] ---
-        # 在处理游戏逻辑之前，确保画面是最新的
-        # (这行代码可能不是必须的，但加上更保险)
-        if game_engine.is_running() and game_engine._wait_mode == 'none':
-             game_engine._redraw_scene()
-             game_engine._draw_sidebar()
-
+        # update 内部连续执行到下一个等待点，并在结束时统一重绘和刷新屏幕
         game_engine.update(
             btn_confirm.was_pressed(), 
             btn_next.was_pressed(),
-            btn_menu.was_pressed()
+            btn_menu.was_pressed(),
+            btn_next.was_long_pressed() # 长按下一项: 回看之前的对话
         )
+        if _TRACE: span_start = utrace.begin()
         music_player.poll()
+        if _TRACE: utrace.end(utrace.SPAN_AUDIO, span_start)
         if not game_engine.is_running():
             print("游戏脚本结束，返回标题界面。")
+            print(f"数据块缓存统计: {chunk_cache.stats()}")
+            gc_policy.report()
+            if game_engine.profiler: game_engine.profiler.export(PROFILE_FILE)
             current_mode = MODE_TITLE
             title_selection = 0
             music_player.stop()
             draw_title_menu()
-    # D. 垃圾回收与延时
-    gc.collect()
+    # D. 垃圾回收与延时: 欢迎/标题界面和脚本等待输入时都算空闲
+    if _TRACE: span_start = utrace.begin()
+    gc_policy.end_tick(current_mode != MODE_OP and (current_mode != MODE_GAME or game_engine.is_idle()))
+    if _TRACE: utrace.end(utrace.SPAN_GC, span_start)
     time.sleep_ms(20)
\ No newline at end of file
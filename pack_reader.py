@@ -0,0 +1,127 @@
+# pack_reader.py
+# 描述: 读取 trpak.py 生成的单文件资源包。整个游戏只持有一个文件句柄，
+#       各子文件以 PackFile 的形式提供，可直接交给 DataReader / BMFont / SongPlayer / ScriptEngine
+#       (它们都接受一个 opener 参数，用法与内建 open 相同)。
+#
+# 资源包格式 (小端序):
+#   文件头 16 字节 '<4sBxHI4x': 魔数 b'RPAK', 版本, 条目数, 扇区大小
+#   目录表 条目数 x 40 字节 '<32sII': 名称 (UTF-8, 以 0 填充), 偏移, 大小
+#   数据区 不小于一个扇区的文件从扇区边界开始；小文件不会跨越扇区边界
+import struct
+try:
+    from micropython import const
+except ImportError: # 在电脑上由 trpak.py 导入，用于校验生成的资源包
+    def const(x): return x
+
+_PAK_MAGIC = b'RPAK'
+_PAK_VERSION = const(1)
+_PAK_HEADER_SIZE = const(16)
+_PAK_ENTRY_SIZE = const(40)
+_PAK_NAME_SIZE = const(32)
+_READLINE_CHUNK = const(64)
+
+class PackFile:
+    """资源包内单个文件的只读视图，共享 PackReader 的文件句柄。"""
+    __slots__ = ('_pack_file', '_base', '_size', '_pos', '_text')
+    def __init__(self, pack_file, base, size, text=False):
+        self._pack_file = pack_file
+        self._base = base
+        self._size = size
+        self._pos = 0
+        self._text = text
+
+    def seek(self, offset, whence=0):
+        if whence == 1: offset += self._pos
+        elif whence == 2: offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, n=-1):
+        remaining = self._size - self._pos
+        if n < 0 or n > remaining: n = remaining
+        if n <= 0: return '' if self._text else b''
+        self._pack_file.seek(self._base + self._pos)
+        data = self._pack_file.read(n)
+        self._pos += len(data)
+        return str(data, 'utf-8') if self._text else data
+
+    def readinto(self, buf):
+        remaining = self._size - self._pos
+        n = len(buf)
+        if remaining <= 0: return 0
+        if n > remaining:
+            buf = memoryview(buf)[:remaining]
+        self._pack_file.seek(self._base + self._pos)
+        count = self._pack_file.readinto(buf)
+        self._pos += count
+        return count
+
+    def readline(self):
+        line = b''
+        f = self._pack_file
+        while self._pos < self._size:
+            f.seek(self._base + self._pos)
+            chunk = f.read(min(_READLINE_CHUNK, self._size - self._pos))
+            if not chunk: break
+            nl = chunk.find(b'\n')
+            if nl >= 0:
+                line += chunk[:nl + 1]; self._pos += nl + 1; break
+            line += chunk; self._pos += len(chunk)
+        return str(line, 'utf-8') if self._text else line
+
+    def close(self):
+        self._pack_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class PackReader:
+    def __init__(self, filepath):
+        self._file = open(filepath, 'rb')
+        try:
+            header = self._file.read(_PAK_HEADER_SIZE)
+            if len(header) != _PAK_HEADER_SIZE or header[:4] != _PAK_MAGIC:
+                raise ValueError("资源包格式不正确: " + filepath)
+            version, count, self.sector_size = struct.unpack_from('<BxHI', header, 4)
+            if version != _PAK_VERSION:
+                raise ValueError("资源包版本不正确: " + str(version))
+            toc = self._file.read(count * _PAK_ENTRY_SIZE)
+            self._toc = {}
+            for i in range(count):
+                base = i * _PAK_ENTRY_SIZE
+                name = bytes(toc[base:base + _PAK_NAME_SIZE])
+                end = name.find(b'\x00')
+                if end >= 0: name = name[:end]
+                self._toc[str(name, 'utf-8')] = struct.unpack_from('<II', toc, base + _PAK_NAME_SIZE)
+        except Exception:
+            self._file.close()
+            raise
+        print(f"资源包: 已加载 '{filepath}' ({count} 个文件)。")
+
+    @staticmethod
+    def _normalize(name):
+        return name.lstrip('/')
+
+    def exists(self, name):
+        return self._normalize(name) in self._toc
+
+    def size(self, name):
+        return self._toc[self._normalize(name)][1]
+
+    def open(self, name, mode='rb'):
+        """与内建 open 兼容的子文件打开函数 ('r' 返回文本，'rb' 返回字节)。"""
+        if self._file is None: raise OSError("资源包已关闭")
+        entry = self._toc.get(self._normalize(name))
+        if entry is None: raise OSError(2, "资源包中不存在: " + name) # ENOENT
+        return PackFile(self._file, entry[0], entry[1], 'b' not in mode)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
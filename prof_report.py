@@ -0,0 +1,70 @@
+# prof_report.py
+# 描述: 读取设备导出的脚本性能数据 (script_profile.py 的 profile.bin) 和 trsc.py 生成的源码映射
+#       (final_script.map.json)，按标签和原始脚本行汇总执行次数与耗时，列出最耗时的部分。
+import sys
+import json
+import struct
+import argparse
+
+PRF_MAGIC = b'RPRF'
+PRF_VERSION = 2
+PRF_HEADER_FORMAT = '<4sBBHIII'
+
+def read_profile(path):
+    """返回 (shift, 执行次数列表, 耗时列表, (刷新次数, 刷新耗时))。"""
+    with open(path, 'rb') as f: data = f.read()
+    header_size = struct.calcsize(PRF_HEADER_FORMAT)
+    magic, version, shift, _, buckets, flush_count, flush_us = struct.unpack_from(PRF_HEADER_FORMAT, data)
+    if magic != PRF_MAGIC or version != PRF_VERSION:
+        print(f"致命错误: '{path}' 不是有效的性能数据文件。"); sys.exit(1)
+    if len(data) != header_size + 8 * buckets:
+        print(f"致命错误: '{path}' 大小与桶数 {buckets} 不符。"); sys.exit(1)
+    counts = struct.unpack_from(f'<{buckets}I', data, header_size)
+    times = struct.unpack_from(f'<{buckets}I', data, header_size + 4 * buckets)
+    return shift, counts, times, (flush_count, flush_us)
+
+def read_source_map(path):
+    with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+
+def aggregate(shift, counts, times, source_map):
+    """
+    把每个桶的数据归到桶内第一行对应的原始脚本行和标签上 (shift > 0 时桶内其余行的数据也计入该行)。
+    返回 (按标签汇总 {标签: [次数, 耗时]}, 按输入行汇总 {输入行号: [次数, 耗时, 标签]})。
+    """
+    input_lines, label_ids, labels = source_map["input_lines"], source_map["label_ids"], source_map["labels"]
+    by_label, by_line = {}, {}
+    for bucket, (count, elapsed) in enumerate(zip(counts, times)):
+        if not count and not elapsed: continue
+        output_line = bucket << shift
+        if output_line >= len(input_lines): continue
+        label_id = label_ids[output_line]
+        label = labels[label_id] if label_id >= 0 else "(开头)"
+        input_line = input_lines[output_line]
+        entry = by_label.setdefault(label, [0, 0]); entry[0] += count; entry[1] += elapsed
+        entry = by_line.setdefault(input_line, [0, 0, label]); entry[0] += count; entry[1] += elapsed
+    return by_label, by_line
+
+def main():
+    parser = argparse.ArgumentParser(description="把设备端脚本性能数据还原到原始脚本的标签与行。")
+    parser.add_argument("profile_file", help="设备导出的性能数据文件 (profile.bin)。")
+    parser.add_argument("source_map", help="trsc.py 生成的源码映射 (final_script.map.json)。")
+    parser.add_argument("--top", type=int, default=20, help="列出耗时最多的前 N 项 (默认 20)。")
+    args = parser.parse_args()
+
+    shift, counts, times, (flush_count, flush_us) = read_profile(args.profile_file)
+    source_map = read_source_map(args.source_map)
+    by_label, by_line = aggregate(shift, counts, times, source_map)
+    total_time = max(1, sum(times) + flush_us)
+    source_name = source_map.get("source") or "原始脚本"
+
+    print(f"共执行 {sum(counts)} 条指令，耗时 {sum(times) // 1000} ms (每桶 {1 << shift} 行)。")
+    print(f"合并重绘/刷新 {flush_count} 次，耗时 {flush_us // 1000} ms {flush_us * 100 // total_time}% (不计入下列标签和行)。")
+    print(f"\n耗时最多的标签:")
+    for label, (count, elapsed) in sorted(by_label.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {elapsed // 1000:>8} ms {elapsed * 100 // total_time:>3}%  {count:>7} 次  {label}")
+    print(f"\n耗时最多的 {source_name} 行:")
+    for input_line, (count, elapsed, label) in sorted(by_line.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {elapsed // 1000:>8} ms {elapsed * 100 // total_time:>3}%  {count:>7} 次  第 {input_line} 行 ({label})")
+
+if __name__ == "__main__":
+    main()
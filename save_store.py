@@ -0,0 +1,130 @@
+# save_store.py
+# 描述: 追加写入的多槽位存档日志。文件在创建时一次性预分配为 capacity 条定长记录，
+#       之后每次存档只覆盖其中一条记录，不再改名、新建或截断文件，减少 Flash 元数据操作。
+#       写入位置在整个文件中循环前进 (磨损均衡)，但不会覆盖任何槽位当前最新的那条记录；
+#       写到一半断电只会损坏正在写的这一条，该槽位的上一条记录仍然有效。
+#       打开时顺序扫描全部记录 (上限 capacity 条)，按序号找出每个槽位最新的有效记录。
+#
+# 记录格式 (小端序，record_size 字节):
+#   '<2sBBI' 8 字节: 魔数 b'RJ', 槽位, 保留, 序号 (从 1 开始递增)
+#   存档数据 payload_size 字节，补零对齐到 4 字节
+#   CRC32 4 字节 (覆盖前面全部内容)
+#   未写过的记录全为 0xFF，魔数不符，扫描时直接跳过。
+import struct
+import ucrc32
+from micropython import const
+
+_JNL_MAGIC = b'RJ'
+_JNL_HEADER_FORMAT = '<2sBBI'
+_JNL_HEADER_SIZE = const(8)
+_JNL_CRC_SIZE = const(4)
+_SEQ_LIMIT = const(0xFFFFFFFF)
+
+class SaveStore:
+    def __init__(self, path, payload_size, slots=4, capacity=32):
+        if capacity <= slots: raise ValueError("日志容量必须大于槽位数")
+        self.path = path
+        self.payload_size = payload_size
+        self.slots = slots
+        self.capacity = capacity
+        self.record_size = _JNL_HEADER_SIZE + ((payload_size + 3) & ~3) + _JNL_CRC_SIZE
+        self._buf = bytearray(self.record_size)
+        self._mv = memoryview(self._buf)
+        self._latest_seq = [0] * slots   # 每个槽位最新记录的序号，0 表示空
+        self._latest_pos = [-1] * slots  # 每个槽位最新记录在文件中的位置 (记录下标)
+        self._seq = 0                    # 全日志最大序号
+        self._next = 0                   # 下一次写入的起始位置
+
+    def open(self):
+        """扫描日志；文件不存在或大小不符时重新预分配一个空日志。返回有效记录数。"""
+        size = self.capacity * self.record_size
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, 2)
+                if f.tell() == size: return self._scan(f)
+            print(f"存档日志 '{self.path}' 大小不符，正在重建...")
+        except OSError:
+            print(f"存档日志 '{self.path}' 不存在，正在创建...")
+        self._format()
+        return 0
+
+    def _format(self):
+        for i in range(self.record_size): self._buf[i] = 0xFF
+        with open(self.path, 'wb') as f:
+            for _ in range(self.capacity): f.write(self._buf)
+        for s in range(self.slots):
+            self._latest_seq[s] = 0; self._latest_pos[s] = -1
+        self._seq = 0; self._next = 0
+
+    def _valid(self):
+        """校验 _buf 中的记录，返回 (槽位, 序号)；无效时返回 None。"""
+        magic, slot, _, seq = struct.unpack_from(_JNL_HEADER_FORMAT, self._buf)
+        if magic != _JNL_MAGIC or slot >= self.slots or seq == 0: return None
+        body = self.record_size - _JNL_CRC_SIZE
+        if struct.unpack_from('<I', self._buf, body)[0] != ucrc32.ucrc32(self._mv[:body]): return None
+        return slot, seq
+
+    def _scan(self, f):
+        f.seek(0)
+        found = 0
+        for pos in range(self.capacity):
+            if f.readinto(self._buf) != self.record_size: break
+            entry = self._valid()
+            if not entry: continue
+            slot, seq = entry
+            found += 1
+            if seq > self._latest_seq[slot]:
+                self._latest_seq[slot] = seq; self._latest_pos[slot] = pos
+            if seq > self._seq:
+                self._seq = seq; self._next = (pos + 1) % self.capacity
+        return found
+
+    def has(self, slot):
+        return self._latest_seq[slot] != 0
+
+    def is_empty(self):
+        return self._seq == 0
+
+    def latest_slot(self):
+        """最近一次写入的槽位，日志为空时返回 -1。"""
+        best = -1
+        for s in range(self.slots):
+            if self._latest_seq[s] and (best < 0 or self._latest_seq[s] > self._latest_seq[best]): best = s
+        return best
+
+    def load(self, slot):
+        """返回槽位最新的有效存档数据 (bytes)，没有时返回 None。"""
+        pos = self._latest_pos[slot]
+        if pos < 0: return None
+        with open(self.path, 'rb') as f:
+            f.seek(pos * self.record_size)
+            f.readinto(self._buf)
+        entry = self._valid()
+        if not entry or entry[0] != slot:
+            # 上次扫描之后记录被外部破坏，重新扫描找回更早的有效记录
+            self._latest_seq[slot] = 0; self._latest_pos[slot] = -1
+            with open(self.path, 'rb') as f: self._scan(f)
+            if self._latest_pos[slot] == pos or self._latest_pos[slot] < 0: return None
+            return self.load(slot)
+        return bytes(self._mv[_JNL_HEADER_SIZE:_JNL_HEADER_SIZE + self.payload_size])
+
+    def save(self, slot, payload):
+        """把存档数据追加为槽位的新记录，只覆盖一条记录，不改变文件大小。"""
+        if len(payload) != self.payload_size: raise ValueError("存档数据长度错误")
+        if self._seq >= _SEQ_LIMIT: raise ValueError("存档日志序号已用尽")
+        # 跳过仍是某个槽位最新记录的位置 (容量大于槽位数，一定能找到)
+        pos = self._next
+        while pos in self._latest_pos: pos = (pos + 1) % self.capacity
+        seq = self._seq + 1
+        buf = self._buf
+        for i in range(len(buf)): buf[i] = 0
+        struct.pack_into(_JNL_HEADER_FORMAT, buf, 0, _JNL_MAGIC, slot, 0, seq)
+        buf[_JNL_HEADER_SIZE:_JNL_HEADER_SIZE + self.payload_size] = payload
+        body = self.record_size - _JNL_CRC_SIZE
+        struct.pack_into('<I', buf, body, ucrc32.ucrc32(self._mv[:body]))
+        with open(self.path, 'r+b') as f:
+            f.seek(pos * self.record_size)
+            f.write(buf)
+        self._seq = seq
+        self._next = (pos + 1) % self.capacity
+        self._latest_seq[slot] = seq; self._latest_pos[slot] = pos
@@ -0,0 +1,137 @@
+# script_index.py
+# 描述: 脚本行偏移索引。FlatIndex 对应每行 4 字节的 final_script.idx；
+#       CompactIndex 对应 trsc.py --index compact 生成的差分索引，每 K 行一个绝对检查点，
+#       其余行只存行长度差分 (uint8，>= 255 时为 0xFF + uint16)，查找代价 O(K)，顺序访问 O(1)。
+#
+# 紧凑索引格式 (小端序):
+#   文件头 20 字节 '<4sBBHIII': 魔数 b'RCDX', 版本, 保留, 检查点间隔 K, 行数, 检查点数, 差分流字节数
+#   检查点 检查点数 x '<II': 该行的脚本偏移, 下一行差分在差分流中的位置
+#   差分流 非检查点行的行长度差分
+import struct
+from micropython import const
+
+_CDX_MAGIC = b'RCDX'
+_CDX_VERSION = const(1)
+_CDX_HEADER_SIZE = const(20)
+_DELTA_ESCAPE = const(0xFF)
+
+class FlatIndex:
+    """每行一个 uint32 偏移的平铺索引，整体常驻内存。"""
+    def __init__(self, data):
+        self._data = data
+        self.count = len(data) // 4
+
+    def offset(self, line: int) -> int:
+        return struct.unpack_from('<I', self._data, line * 4)[0]
+
+    def resident_bytes(self) -> int:
+        return len(self._data)
+
+    def fork(self):
+        return self # 没有查找状态，可以直接共用
+
+class CompactIndex:
+    """
+    差分编码的紧凑索引。paged=False 时差分流整体常驻内存；
+    paged=True 时只常驻检查点表，差分流按检查点分页从文件读入 (同一时刻只保留一页)。
+    source 为另一个 CompactIndex 时不读文件，共享它的检查点表和常驻差分流 (见 fork())。
+    """
+    def __init__(self, f, base: int = 0, paged: bool = False, source=None):
+        if source is not None:
+            self._share(source); return
+        f.seek(base)
+        magic, version, _, interval, count, checkpoint_count, stream_size = struct.unpack('<4sBBHIII', f.read(_CDX_HEADER_SIZE))
+        if magic != _CDX_MAGIC or version != _CDX_VERSION:
+            raise ValueError("紧凑索引格式不正确")
+        self.count = count
+        self._interval = interval
+        self._checkpoint_count = checkpoint_count
+        self._checkpoints = f.read(checkpoint_count * 8)
+        self._stream_size = stream_size
+        self._stream_base = base + _CDX_HEADER_SIZE + checkpoint_count * 8
+        self._file = f if paged else None
+        if paged:
+            self._stream = bytearray(3 * interval) # 一页最多 K-1 个差分，每个最多 3 字节
+            self._page = -1
+            self._page_start = 0
+        else:
+            self._stream = f.read(stream_size)
+        self._reset()
+
+    def _share(self, source):
+        self.count = source.count
+        self._interval = source._interval
+        self._checkpoint_count = source._checkpoint_count
+        self._checkpoints = source._checkpoints
+        self._stream_size = source._stream_size
+        self._stream_base = source._stream_base
+        self._file = source._file
+        if self._file is not None:
+            self._stream = bytearray(len(source._stream)) # 分页缓冲各用各的
+            self._page = -1
+            self._page_start = 0
+        else:
+            self._stream = source._stream
+        self._reset()
+
+    def _reset(self):
+        self._last_line = -1
+        self._last_offset = 0
+        self._last_pos = 0
+
+    def fork(self):
+        """
+        返回查找同一份索引的第二个游标: 顺序访问缓存 (分页时还有当前页) 是自己的，
+        与原索引交错查找时互不打乱对方的缓存。分页时多占一页缓冲，其余内存共用。
+        """
+        return CompactIndex(None, source=self)
+
+    def _load_page(self, block: int):
+        start = struct.unpack_from('<I', self._checkpoints, block * 8 + 4)[0]
+        if block + 1 < self._checkpoint_count:
+            end = struct.unpack_from('<I', self._checkpoints, block * 8 + 12)[0]
+        else:
+            end = self._stream_size
+        self._file.seek(self._stream_base + start)
+        self._file.readinto(memoryview(self._stream)[:end - start])
+        self._page = block
+        self._page_start = start
+
+    def offset(self, line: int) -> int:
+        interval = self._interval
+        if line == self._last_line:
+            return self._last_offset
+        block = line // interval
+        if line == self._last_line + 1 and line % interval:
+            # 顺序访问: 只需在上一行的基础上再解一个差分
+            off, pos, steps = self._last_offset, self._last_pos, 1
+        else:
+            off, pos = struct.unpack_from('<II', self._checkpoints, block * 8)
+            steps = line - block * interval
+        if steps:
+            shift = 0
+            if self._file is not None:
+                if block != self._page: self._load_page(block)
+                shift = self._page_start
+            stream = self._stream
+            for _ in range(steps):
+                i = pos - shift
+                delta = stream[i]
+                if delta == _DELTA_ESCAPE:
+                    delta = stream[i + 1] | (stream[i + 2] << 8); pos += 3
+                else:
+                    pos += 1
+                off += delta
+        self._last_line, self._last_offset, self._last_pos = line, off, pos
+        return off
+
+    def resident_bytes(self) -> int:
+        return len(self._checkpoints) + len(self._stream)
+
+def open_index(f, base: int, line_count: int, paged: bool = False):
+    """根据魔数在 f 的 base 处识别索引类型 (紧凑或平铺) 并加载。"""
+    f.seek(base)
+    if f.read(4) == _CDX_MAGIC:
+        return CompactIndex(f, base, paged)
+    f.seek(base)
+    return FlatIndex(f.read(line_count * 4))
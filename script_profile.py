@@ -0,0 +1,53 @@
+# script_profile.py
+# 描述: 脚本行级性能计数器。按输出行 (即引擎的 PC) 统计执行次数和执行耗时，
+#       导出后在电脑上用 prof_report.py 结合 trsc.py 生成的 source map 还原到原始脚本的行和标签。
+#       每 2^shift 行合并为一个桶，两个 uint32 数组共 8 字节/桶，shift 按可用内存选择。
+#       批量执行结束时合并进行的场景重绘和屏幕刷新单独计入刷新桶，不算到批次中任何一行上。
+#
+# 导出格式 (小端序):
+#   文件头 20 字节 '<4sBBHIII': 魔数 b'RPRF', 版本, shift, 保留, 桶数, 刷新次数, 刷新耗时 (微秒)
+#   执行次数 桶数 x uint32
+#   执行耗时 桶数 x uint32 (微秒)
+import struct
+from array import array
+from micropython import const
+
+_PRF_MAGIC = b'RPRF'
+_PRF_VERSION = const(2)
+
+class ScriptProfiler:
+    def __init__(self, line_count: int, shift: int = 0):
+        self.shift = shift
+        buckets = (line_count >> shift) + 1
+        self.counts = array('I', [0] * buckets)
+        self.time_us = array('I', [0] * buckets)
+        self.flush_count = 0
+        self.flush_us = 0
+
+    def record(self, pc: int, elapsed_us: int):
+        bucket = pc >> self.shift
+        if bucket < len(self.counts):
+            self.counts[bucket] += 1
+            self.time_us[bucket] += elapsed_us
+
+    def record_flush(self, elapsed_us: int):
+        self.flush_count += 1
+        self.flush_us += elapsed_us
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+            self.time_us[i] = 0
+        self.flush_count = 0
+        self.flush_us = 0
+
+    def export(self, path: str):
+        try:
+            with open(path, 'wb') as f:
+                f.write(struct.pack('<4sBBHIII', _PRF_MAGIC, _PRF_VERSION, self.shift, 0, len(self.counts),
+                                    self.flush_count, self.flush_us))
+                f.write(self.counts)
+                f.write(self.time_us)
+            print(f"脚本性能数据已导出到 '{path}' ({len(self.counts)} 个桶)。")
+        except OSError as e:
+            print(f"脚本性能数据导出失败: {e}")
@@ -4,8 +4,9 @@ import os
 import numpy as np
 import json
 import sys
+from trdat import write_dat
 
-def process_background_images_adaptive(input_folder, output_folder, asset_list, density_threshold=0.6, max_attempts=5):
+def process_background_images_adaptive(input_folder, output_folder, asset_list, density_threshold=0.6, max_attempts=5, near_threshold=0, compress=False):
     """
     【背景图自适应简化策略】
     根据资产清单，按需处理并打包背景图。
@@ -110,13 +111,9 @@ def process_background_images_adaptive(input_folder, output_folder, asset_list,
             except Exception as e:
                 print(f"处理图片 {filename} 时发生错误: {e}")
 
-        # 将所有数据块按顺序写入文件
-        for block in output_data_blocks:
-            if block:
-                f_out.write(block)
-            else:
-                # 如果某个块处理失败，写入一个空白块以保证索引正确
-                f_out.write(b'\x00' * (target_w * target_h // 8))
+        # 将所有数据块按顺序去重后写入文件 (某个块处理失败时用空白块占位以保证索引正确)
+        blocks = [block if block else b'\x00' * (target_w * target_h // 8) for block in output_data_blocks]
+        write_dat(f_out, blocks, target_w * target_h // 8, near_threshold, compress)
         
         print("\n所有必需的背景图片已打包到 bg.dat！")
 # trbg.py
@@ -129,6 +126,8 @@ if __name__ == '__main__':
     
     DENSITY_LIMIT = 0.5
     MAX_ATTEMPTS = 50
+    NEAR_DEDUP_BITS = 0 # 近似去重阈值 (像素数)，0 表示只合并完全相同的背景
+    COMPRESS_DAT = False # True: 以 PackBits 压缩容器输出 bg.dat (读取时多一次解码，换取更小的文件)
     
     try:
         with open(manifest_path, 'r', encoding='utf-8') as f:
@@ -159,7 +158,9 @@ if __name__ == '__main__':
                 output_folder_path,
                 asset_list=sorted_asset_list,
                 density_threshold=DENSITY_LIMIT,
-                max_attempts=MAX_ATTEMPTS
+                max_attempts=MAX_ATTEMPTS,
+                near_threshold=NEAR_DEDUP_BITS,
+                compress=COMPRESS_DAT
             )
     except FileNotFoundError:
         print(f"致命错误: 资产清单文件 '{manifest_path}' 未找到。请先运行 preprocess.py。")
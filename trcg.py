@@ -4,8 +4,9 @@ import os
 import numpy as np
 import json
 import sys
+from trdat import write_dat
 
-def process_cg_for_mcu(input_folder, output_folder, asset_list):
+def process_cg_for_mcu(input_folder, output_folder, asset_list, near_threshold=0, compress=False):
     """
     【轮廓重绘方案】根据资产清单，按需处理并打包CG图片。
     """
@@ -90,12 +91,9 @@ def process_cg_for_mcu(input_folder, output_folder, asset_list):
             except Exception as e:
                 print(f"处理图片 {filename} 时发生错误: {e}")
 
-        # 将所有数据块按顺序写入文件
-        for block in output_data_blocks:
-            if block:
-                f_out.write(block)
-            else:
-                f_out.write(b'\x00' * (target_w * target_h // 8))
+        # 将所有数据块按顺序去重后写入文件
+        blocks = [block if block else b'\x00' * (target_w * target_h // 8) for block in output_data_blocks]
+        write_dat(f_out, blocks, target_w * target_h // 8, near_threshold, compress)
 
         print("\n所有必需的CG图片已打包到 cg.dat！")
 
@@ -103,6 +101,8 @@ if __name__ == '__main__':
     manifest_path = 'assets_manifest.json'
     input_folder_path = "pic"         # 包含源 CG 图的文件夹
     output_folder_path = "outcg"      # 输出处理后的预览图和 .dat 文件
+    NEAR_DEDUP_BITS = 0               # 近似去重阈值 (像素数)，0 表示只合并完全相同的立绘
+    COMPRESS_DAT = False              # True: 以 PackBits 压缩容器输出 cg.dat (读取时多一次解码，换取更小的文件)
     
     try:
         with open(manifest_path, 'r', encoding='utf-8') as f:
@@ -121,7 +121,9 @@ if __name__ == '__main__':
             process_cg_for_mcu(
                 input_folder_path, 
                 output_folder_path,
-                asset_list=sorted_asset_list
+                asset_list=sorted_asset_list,
+                near_threshold=NEAR_DEDUP_BITS,
+                compress=COMPRESS_DAT
             )
     except FileNotFoundError:
         print(f"致命错误: 资产清单文件 '{manifest_path}' 未找到。请先运行 preprocess.py。")
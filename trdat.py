@@ -0,0 +1,138 @@
+# trdat.py
+# 描述: .dat 资源容器打包器。对数据块去重 (可选近似去重)，可选 RLE 压缩，
+#       写入文件头与索引表，由 data_reader.DataReader 在设备端透明地解析。
+#
+# 容器格式 (小端序):
+#   文件头 16 字节 '<4sBBHHH4x': 魔数 b'RDAT', 版本, 标志位, 块大小, 逻辑块数, 物理块数
+#   索引表 逻辑块数 x uint16: 逻辑索引 -> 物理块编号
+#   [仅压缩] 偏移表 (物理块数 + 1) x uint32: 各物理块相对数据区起点的偏移
+#   数据区 未压缩时为 物理块数 x 块大小；压缩时为变长的 PackBits 数据
+#          (压缩后不小于块大小的块按原样存放，解码端以长度区分)
+# 未带魔数的旧式平铺 .dat 文件仍可被 DataReader 直接读取。
+import sys
+import struct
+import argparse
+
+DAT_MAGIC = b'RDAT'
+DAT_VERSION = 1
+DAT_HEADER_FORMAT = '<4sBBHHH4x'
+DAT_FLAG_COMPRESSED = 0x01
+
+def packbits_encode(data: bytes) -> bytes:
+    """
+    PackBits 行程编码。控制字节 n: 0-127 复制其后 n+1 个字面字节；
+    129-255 把下一个字节重复 257-n 次。1-bit 图像的大片黑/白区域压缩效果很好。
+    """
+    out, i, n = bytearray(), 0, len(data)
+    while i < n:
+        run = 1
+        while i + run < n and run < 128 and data[i + run] == data[i]:
+            run += 1
+        if run >= 2:
+            out += bytes((257 - run, data[i])); i += run
+            continue
+        start = i; i += 1
+        # 字面段一直延伸到下一个长度 >= 3 的重复段之前
+        while i < n and i - start < 128:
+            if i + 2 < n and data[i] == data[i + 1] == data[i + 2]: break
+            i += 1
+        out.append(i - start - 1); out += data[start:i]
+    return bytes(out)
+
+def packbits_decode(data: bytes, size: int) -> bytes:
+    """与设备端 DataReader 的解码器逻辑一致，用于打包时自检。"""
+    out, i = bytearray(), 0
+    while i < len(data) and len(out) < size:
+        n = data[i]; i += 1
+        if n < 128:
+            out += data[i:i + n + 1]; i += n + 1
+        elif n > 128:
+            out += bytes((data[i],)) * (257 - n); i += 1
+    return bytes(out[:size])
+
+def compress_chunk(block: bytes) -> bytes:
+    """压缩单个块；若压缩后不比原始数据小，则原样返回。"""
+    packed = packbits_encode(block)
+    if len(packed) >= len(block): return block
+    if packbits_decode(packed, len(block)) != block:
+        print("致命错误: PackBits 自检失败。"); sys.exit(1)
+    return packed
+
+def hamming_distance(a: bytes, b: bytes) -> int:
+    """两个等长数据块之间不同的像素 (位) 数。"""
+    return bin(int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).count('1')
+
+def deduplicate_chunks(blocks, near_threshold=0):
+    """
+    返回 (物理块列表, 逻辑->物理映射)。
+    near_threshold > 0 时，与已有块相差不超过该位数的块也会被合并。
+    """
+    physical, mapping, exact = [], [], {}
+    for block in blocks:
+        phys_id = exact.get(block)
+        if phys_id is None and near_threshold > 0:
+            for i, candidate in enumerate(physical):
+                if hamming_distance(block, candidate) <= near_threshold:
+                    phys_id = i; break
+        if phys_id is None:
+            phys_id = len(physical)
+            physical.append(block)
+            exact[block] = phys_id
+        mapping.append(phys_id)
+    return physical, mapping
+
+def write_dat(output, blocks, chunk_size, near_threshold=0, compress=False):
+    """把数据块列表写成带索引表的 .dat 容器，返回 (逻辑块数, 物理块数)。output 为文件路径或以 'wb' 打开的文件。"""
+    for i, block in enumerate(blocks):
+        if len(block) != chunk_size:
+            print(f"致命错误: 第 {i} 个数据块大小为 {len(block)}，应为 {chunk_size}。"); sys.exit(1)
+    if len(blocks) > 65535:
+        print(f"致命错误: 数据块数量 {len(blocks)} 超出索引表上限 65535。"); sys.exit(1)
+
+    physical, mapping = deduplicate_chunks(blocks, near_threshold)
+    flags = DAT_FLAG_COMPRESSED if compress else 0
+    stored = [compress_chunk(block) for block in physical] if compress else physical
+    f_out = open(output, 'wb') if isinstance(output, str) else output
+    try:
+        f_out.write(struct.pack(DAT_HEADER_FORMAT, DAT_MAGIC, DAT_VERSION, flags, chunk_size, len(mapping), len(physical)))
+        f_out.write(struct.pack(f'<{len(mapping)}H', *mapping))
+        if compress:
+            offsets = [0]
+            for block in stored:
+                offsets.append(offsets[-1] + len(block))
+            f_out.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        for block in stored:
+            f_out.write(block)
+        packed_size = f_out.tell()
+    finally:
+        if f_out is not output: f_out.close()
+
+    flat_size = len(blocks) * chunk_size
+    print(f"去重: {len(blocks)} 个逻辑块 -> {len(physical)} 个物理块"
+          f"{'，已压缩' if compress else ''}，{flat_size} -> {packed_size} 字节 ({getattr(output, 'name', output)})")
+    return len(mapping), len(physical)
+
+def read_flat_dat(input_path, chunk_size):
+    """读取旧式平铺 .dat 文件，按块切分。"""
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    if data[:4] == DAT_MAGIC:
+        print(f"致命错误: '{input_path}' 已经是 RDAT 容器。"); sys.exit(1)
+    if len(data) % chunk_size:
+        print(f"警告: 文件大小 {len(data)} 不是块大小 {chunk_size} 的整数倍，末尾多余字节将被丢弃。")
+    return [data[i:i + chunk_size] for i in range(0, len(data) - chunk_size + 1, chunk_size)]
+
+def main():
+    parser = argparse.ArgumentParser(description="将平铺的 .dat 文件 (如 op.dat) 重新打包为去重容器。")
+    parser.add_argument("input_file", help="输入的平铺 .dat 文件。")
+    parser.add_argument("chunk_size", type=int, help="每个数据块的字节数 (背景/OP 为 576，立绘为 144)。")
+    parser.add_argument("-o", "--output", help="输出文件路径 (默认覆盖输入文件)。")
+    parser.add_argument("--near", type=int, default=0, help="近似去重阈值: 允许相差的像素数 (默认 0，仅合并完全相同的块)。")
+    parser.add_argument("--compress", action="store_true", help="对每个物理块做 PackBits 行程压缩。")
+    args = parser.parse_args()
+
+    blocks = read_flat_dat(args.input_file, args.chunk_size)
+    write_dat(args.output or args.input_file, blocks, args.chunk_size, args.near, args.compress)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# trpak.py
+# 描述: 把设备端需要的全部资源 (bg.dat, cg.dat, op.dat, 1.bmf, final_script.*, bgm/<曲名>/...)
+#       打包成一个按 Flash 扇区对齐的资源包，由设备端 pack_reader.PackReader 读取。
+#       格式说明见 pack_reader.py。
+import os
+import sys
+import struct
+import argparse
+from pack_reader import PackReader
+
+PAK_MAGIC = b'RPAK'
+PAK_VERSION = 1
+PAK_HEADER_FORMAT = '<4sBxHI4x'
+PAK_ENTRY_FORMAT = '<32sII'
+PAK_NAME_SIZE = 32
+DEFAULT_SECTOR_SIZE = 4096
+EXCLUDED_FILES = {'save.dat', 'save.bak', 'save.jnl', 'seen.dat', 'profile.bin'}
+EXCLUDED_EXTENSIONS = ('.py', '.mpy', '.pak', '.json', '.png')
+
+def collect_asset_files(root_dir):
+    """按设备上的相对路径 (使用 '/' 分隔) 收集资源文件，返回排序后的 [(名称, 本地路径)]。"""
+    assets = []
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if filename in EXCLUDED_FILES or filename.lower().endswith(EXCLUDED_EXTENSIONS): continue
+            local_path = os.path.join(dirpath, filename)
+            name = os.path.relpath(local_path, root_dir).replace(os.sep, '/')
+            if len(name.encode('utf-8')) > PAK_NAME_SIZE:
+                print(f"致命错误: 文件名 '{name}' 超过 {PAK_NAME_SIZE} 字节。"); sys.exit(1)
+            assets.append((name, local_path))
+    return sorted(assets)
+
+def place_file(offset, size, sector_size):
+    """
+    计算文件的起始偏移: 不小于一个扇区的文件从扇区边界开始；
+    小文件紧接着上一个文件存放，只有在会跨越扇区边界时才对齐到下一扇区。
+    """
+    in_sector = offset % sector_size
+    if in_sector and (size >= sector_size or in_sector + size > sector_size):
+        offset += sector_size - in_sector
+    return offset
+
+def build_pack(root_dir, output_path, sector_size=DEFAULT_SECTOR_SIZE):
+    assets = collect_asset_files(root_dir)
+    if not assets:
+        print(f"致命错误: 在 '{root_dir}' 中没有找到任何资源文件。"); sys.exit(1)
+
+    toc_size = struct.calcsize(PAK_HEADER_FORMAT) + len(assets) * struct.calcsize(PAK_ENTRY_FORMAT)
+    entries, offset = [], toc_size
+    for name, local_path in assets:
+        size = os.path.getsize(local_path)
+        offset = place_file(offset, size, sector_size)
+        entries.append((name, local_path, offset, size))
+        offset += size
+
+    with open(output_path, 'wb') as f_out:
+        f_out.write(struct.pack(PAK_HEADER_FORMAT, PAK_MAGIC, PAK_VERSION, len(entries), sector_size))
+        for name, _, file_offset, size in entries:
+            f_out.write(struct.pack(PAK_ENTRY_FORMAT, name.encode('utf-8'), file_offset, size))
+        for name, local_path, file_offset, size in entries:
+            f_out.write(b'\x00' * (file_offset - f_out.tell()))
+            with open(local_path, 'rb') as f_in:
+                f_out.write(f_in.read())
+            print(f"  {file_offset:>9}  {size:>8}  {name}")
+        total_size = f_out.tell()
+
+    payload = sum(size for _, _, _, size in entries)
+    print(f"资源包已生成: '{output_path}'，{len(entries)} 个文件，"
+          f"{total_size} 字节 (有效数据 {payload} 字节，对齐填充 {total_size - payload - toc_size} 字节)。")
+
+def verify_pack(output_path, assets):
+    """
+    用设备端的 PackReader 读回资源包: 每个文件按整块、readinto 分块逐一比对，
+    乐曲的 metadata.txt 按 SongPlayer 的方式以文本模式逐行 readline 解析出 BPM。返回是否全部通过。
+    """
+    pack = PackReader(output_path)
+    errors = 0
+    try:
+        for name, local_path in assets:
+            with open(local_path, 'rb') as f_in: expected = f_in.read()
+            with pack.open(name, 'rb') as f: data = f.read()
+            chunks, buf = [], bytearray(250)
+            with pack.open(name, 'rb') as f:
+                while True:
+                    n = f.readinto(buf)
+                    if not n: break
+                    chunks.append(bytes(buf[:n]))
+            if data != expected or b''.join(chunks) != expected:
+                print(f"校验失败: '{name}' 读回内容不一致。"); errors += 1
+            if name.startswith('bgm/') and name.endswith('/metadata.txt'):
+                bpm = None
+                with pack.open(name, 'r') as f:
+                    while True:
+                        line = f.readline()
+                        if not line: break
+                        key, _, value = line.partition(':')
+                        if key.strip().upper() == 'BPM': bpm = float(value.strip())
+                if bpm is None:
+                    print(f"校验失败: '{name}' 中没有读到 BPM。"); errors += 1
+    finally:
+        pack.close()
+    if errors: print(f"资源包校验失败: {errors} 个错误。")
+    else: print(f"资源包校验通过: 已用 PackReader 读回全部 {len(assets)} 个文件。")
+    return errors == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="将设备端资源打包为单个扇区对齐的资源包。")
+    parser.add_argument("root_dir", help="按设备文件系统布局存放资源的目录 (包含 bg.dat、bgm/ 等)。")
+    parser.add_argument("-o", "--output", default="assets.pak", help="输出文件路径 (默认 'assets.pak')。")
+    parser.add_argument("--sector", type=int, default=DEFAULT_SECTOR_SIZE, help="Flash 扇区大小 (默认 4096)。")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root_dir):
+        print(f"致命错误: 资源目录未找到: '{args.root_dir}'"); sys.exit(1)
+    build_pack(args.root_dir, args.output, args.sector)
+    if not verify_pack(args.output, collect_asset_files(args.root_dir)): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
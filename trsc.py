@@ -11,6 +11,38 @@ LABEL_PREFIX = "^LABEL"; JUMP_PREFIX = "^JUMP"; CHOICE_PREFIX = "^CHOICE"; END_P
 BG_PREFIX = "^BG"; CG_PREFIX = "^CG"; BGM_PREFIX = "^BGM"; DATE_PREFIX = "^DATE"
 TITLE_BG_NAME = "air" # 约定好的封面资源名
 
+# 扇区对齐的单文件脚本格式 (--layout sector)
+# 任何一行都不会跨越扇区边界 (不足时用 '\n' 填充到下一扇区)，脚本正文之后是 uint32 行偏移索引，
+# 文件末尾 16 字节为 '<4sBxHII': 魔数 b'RSCR', 版本, 扇区大小, 行数, 索引起始偏移
+SECTOR_SCRIPT_MAGIC = b'RSCR'
+SECTOR_SCRIPT_VERSION = 1
+SECTOR_SCRIPT_TRAILER_FORMAT = '<4sBxHII'
+DEFAULT_SECTOR_SIZE = 4096
+
+# 紧凑差分索引 (--index compact)，格式说明见设备端 script_index.py
+COMPACT_INDEX_MAGIC = b'RCDX'
+COMPACT_INDEX_VERSION = 1
+COMPACT_INDEX_HEADER_FORMAT = '<4sBBHIII'
+COMPACT_INDEX_INTERVAL = 32
+
+# 场景关键帧表 (final_script.kfr)，由设备端 ScriptEngine 用于章节选择、从任意行开始和读档校验
+# 文件头 16 字节 '<4sBxHHH4x': 魔数 b'RKEY', 版本, 间隔 K, 关键帧数, 章节数
+# 关键帧 关键帧数 x '<IHBBBHHHH': 行号 (从 0 开始，表示执行该行之前的状态), BGM, 月, 日, 星期, BG, 左/中/右 CG
+#        (与存档格式相同，空位为 65535)；第 0 行、每个标签所在行以及每 K 行各有一个关键帧
+# 章节 章节数 x '<24sH': 标签名 (UTF-8, 以 0 填充), 关键帧编号
+KEYFRAME_MAGIC = b'RKEY'
+KEYFRAME_VERSION = 1
+KEYFRAME_HEADER_FORMAT = '<4sBxHHH4x'
+KEYFRAME_RECORD_FORMAT = '<IHBBBHHHH'
+KEYFRAME_CHAPTER_FORMAT = '<24sH'
+KEYFRAME_NAME_SIZE = 24
+KEYFRAME_INTERVAL = 64
+NO_ASSET = 65535
+
+# 源码映射 (输出行 -> 输入行/所在标签)，供 prof_report.py 等电脑端工具使用，不需要拷贝到设备
+SOURCE_MAP_VERSION = 1
+SOURCE_MAP_SUFFIX = '.map.json'
+
 # 屏幕与字体尺寸常量 (单位: 半角字符宽度)
 DIALOGUE_LINE_WIDTH_LIMIT = 32
 SPEAKER_CHAR_WIDTH_UNITS = 8
@@ -124,6 +156,65 @@ def pass_one_build_maps_and_collect_assets(script_lines: List[str]) -> (Dict, Di
     print(f"[第一步] 成功: 找到 {len(label_to_output_line)} 个标签并完成资源搜集。")
     return label_to_output_line, label_to_input_line, final_bg_list, sorted(list(cg_assets)), sorted(list(bgm_assets))
 
+def trace_main_route(script_lines: List[str], label_to_input_line: Dict[str, int]) -> List[tuple]:
+    """
+    沿主线模拟执行 (顺序执行，跟随 ^JUMP，^CHOICE 取第一个选项，遇到 ^END 或回到已执行过的行时停止)，
+    返回途经的资源引用序列 [(类型, 名称), ...]。
+    """
+    jump_pattern = re.compile(r'\[JUMP_TO_([^\]]+)\]', re.IGNORECASE)
+    uses, visited, i = [], set(), 0
+    while 0 <= i < len(script_lines) and i not in visited:
+        visited.add(i)
+        stripped_line = script_lines[i].strip(); i += 1
+        if not stripped_line.startswith('^'): continue
+        parts = stripped_line.split()
+        command = parts[0].upper()
+        if command == BG_PREFIX and len(parts) > 1: uses.append(('bg', parts[1]))
+        elif command == CG_PREFIX and len(parts) > 2: uses.append(('cg', parts[2]))
+        elif command == END_PREFIX: break
+        elif command == JUMP_PREFIX or command == CHOICE_PREFIX:
+            match = jump_pattern.search(stripped_line)
+            if match and match.group(1) in label_to_input_line:
+                i = label_to_input_line[match.group(1)] - 1
+    return uses
+
+def order_assets_by_first_use(script_lines: List[str], route_uses: List[tuple], kind: str, pinned_first: List[str] = ()) -> List[str]:
+    """
+    按主线上的首次使用顺序排列资源；不在主线上的资源按其在脚本中首次出现的顺序追加到末尾。
+    pinned_first 中的资源 (如封面) 固定排在最前。
+    """
+    ordered = list(pinned_first)
+    seen = set(ordered)
+    file_uses = []
+    for line in script_lines:
+        parts = line.strip().split()
+        if not parts: continue
+        command = parts[0].upper()
+        if kind == 'bg' and command == BG_PREFIX and len(parts) > 1: file_uses.append(parts[1])
+        elif kind == 'cg' and command == CG_PREFIX and len(parts) > 2: file_uses.append(parts[2])
+    for name in [n for k, n in route_uses if k == kind] + file_uses:
+        if name not in seen:
+            seen.add(name); ordered.append(name)
+    return ordered
+
+def report_distance_histogram(title: str, route_uses: List[tuple], kind: str, index_map: Dict[str, int]):
+    """统计主线上相邻两次加载之间的索引距离 (即在 .dat 文件中的跳跃距离)。"""
+    buckets = [("后退", 0), ("0", 0), ("+1", 0), ("+2~3", 0), ("+4~7", 0), ("+8~15", 0), ("+16~", 0)]
+    sequence = [index_map[n] for k, n in route_uses if k == kind and n in index_map]
+    for prev, cur in zip(sequence, sequence[1:]):
+        delta = cur - prev
+        if delta < 0: slot = 0
+        elif delta == 0: slot = 1
+        elif delta == 1: slot = 2
+        elif delta <= 3: slot = 3
+        elif delta <= 7: slot = 4
+        elif delta <= 15: slot = 5
+        else: slot = 6
+        buckets[slot] = (buckets[slot][0], buckets[slot][1] + 1)
+    total = max(1, len(sequence) - 1)
+    forward = sum(c for _, c in buckets[1:])
+    print(f"  {title}: " + " | ".join(f"{name} {count}" for name, count in buckets) + f"  (顺向比例 {forward * 100 // total}%)")
+
 def resolve_jump_chains(script_lines: List[str], label_to_input_line: Dict[str, int]) -> Dict[str, str]:
     print("[第二步] 正在解析与优化跳转链...")
     resolved_labels = {}
@@ -149,9 +240,119 @@ def resolve_jump_chains(script_lines: List[str], label_to_input_line: Dict[str,
     print(f"[第二步] 成功: 优化了 {optimizations} 条跳转链。")
     return resolved_labels
 
-def pass_three_generate_final_script(script_lines, label_map_output, resolved_labels, asset_maps, output_filepath):
+def encode_compact_index(offsets: List[int], interval: int = COMPACT_INDEX_INTERVAL) -> bytes:
+    """每 interval 行记录一个绝对检查点，其余行只记录与上一行的偏移差 (uint8，>= 255 时为 0xFF + uint16)。"""
+    checkpoints, stream = [], bytearray()
+    for i, offset in enumerate(offsets):
+        if i % interval == 0:
+            checkpoints.append(struct.pack('<II', offset, len(stream)))
+            continue
+        delta = offset - offsets[i - 1]
+        if delta < 0xFF: stream.append(delta)
+        elif delta <= 0xFFFF: stream += bytes((0xFF, delta & 0xFF, delta >> 8))
+        else:
+            print(f"致命错误: 输出第 {i} 行长度 {delta} 字节，超出紧凑索引上限。"); sys.exit(1)
+    header = struct.pack(COMPACT_INDEX_HEADER_FORMAT, COMPACT_INDEX_MAGIC, COMPACT_INDEX_VERSION, 0,
+                         interval, len(offsets), len(checkpoints), len(stream))
+    return header + b''.join(checkpoints) + bytes(stream)
+
+def encode_index(offsets: List[int], index_format: str) -> bytes:
+    if index_format == "compact":
+        return encode_compact_index(offsets)
+    return struct.pack(f'<{len(offsets)}I', *offsets)
+
+def write_sector_aligned_script(final_lines, output_filepath, sector_size=DEFAULT_SECTOR_SIZE, index_format="flat"):
+    """把脚本行按扇区对齐写成单个文件，并在末尾附上行偏移索引。"""
+    offsets, padding_total = [], 0
+    with open(output_filepath, 'wb') as f:
+        offset = 0
+        for line_num, line in enumerate(final_lines, 1):
+            encoded_line = (line + '\n').encode('utf-8')
+            if len(encoded_line) > sector_size:
+                print(f"致命错误: 输出第 {line_num} 行长度 {len(encoded_line)} 字节，超过扇区大小 {sector_size}。"); sys.exit(1)
+            in_sector = offset % sector_size
+            if in_sector + len(encoded_line) > sector_size:
+                padding = sector_size - in_sector
+                f.write(b'\n' * padding); offset += padding; padding_total += padding
+            offsets.append(offset)
+            f.write(encoded_line); offset += len(encoded_line)
+        index_offset = offset
+        index_blob = encode_index(offsets, index_format)
+        f.write(index_blob)
+        f.write(struct.pack(SECTOR_SCRIPT_TRAILER_FORMAT, SECTOR_SCRIPT_MAGIC, SECTOR_SCRIPT_VERSION,
+                            sector_size, len(offsets), index_offset))
+    print(f"[第三步] 成功: 扇区对齐脚本已写入 '{output_filepath}' "
+          f"({len(offsets)} 行，扇区 {sector_size} 字节，填充 {padding_total} 字节，{index_format} 索引 {len(index_blob)} 字节)。")
+
+def write_source_map(path, source_name, source_map):
+    """
+    source_map 为与输出行一一对应的 [(输入行号, 标签名或 None)]。
+    标签名去重后存入 labels，每个输出行只记录输入行号和标签编号 (-1 表示位于第一个标签之前)。
+    """
+    labels, label_ids = [], {}
+    input_lines, line_labels = [], []
+    for input_line_num, label in source_map:
+        if label is not None and label not in label_ids:
+            label_ids[label] = len(labels); labels.append(label)
+        input_lines.append(input_line_num)
+        line_labels.append(label_ids[label] if label is not None else -1)
+    source_map_data = {"version": SOURCE_MAP_VERSION, "source": source_name, "labels": labels,
+                       "input_lines": input_lines, "label_ids": line_labels}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(source_map_data, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"[第三步] 成功: 源码映射已写入 '{path}' ({len(input_lines)} 行，{len(labels)} 个标签)。")
+
+def fold_scene_state(state, line):
+    """
+    把一行最终脚本中影响画面/音乐/日期的指令作用到 state 上
+    (state 为 [BGM, 月, 日, 星期, BG, 左CG, 中CG, 右CG])，与设备端 ScriptEngine._fold_line 一致。
+    """
+    parts = line.split()
+    if not parts or not parts[0].startswith('^'): return
+    command = parts[0].upper()
+    try:
+        if command == BG_PREFIX: state[4] = int(parts[1]); state[5] = state[6] = state[7] = NO_ASSET
+        elif command == CG_PREFIX:
+            pos = 'lcr'.find(parts[1])
+            if len(parts[1]) == 1 and pos >= 0: state[5 + pos] = int(parts[2])
+        elif command == BGM_PREFIX: state[0] = int(parts[1])
+        elif command == '^BGMSTOP': state[0] = NO_ASSET
+        elif command == '^D': state[1], state[2], state[3] = int(parts[1][0:2]), int(parts[1][2:4]), int(parts[1][4])
+    except (IndexError, ValueError): pass
+
+def build_keyframes(final_lines, label_map_output, interval=KEYFRAME_INTERVAL):
+    """
+    沿脚本的线性顺序 (不跟随跳转) 计算场景状态，在第 0 行、每个标签所在行和每 interval 行记录关键帧。
+    返回 (关键帧列表 [(行号, 状态元组)], 章节列表 [(标签名, 关键帧编号)])。
+    """
+    label_lines = {}
+    for label, output_line in label_map_output.items():
+        if output_line - 1 < len(final_lines): label_lines.setdefault(output_line - 1, []).append(label)
+    state = [NO_ASSET, 7, 17, 1, NO_ASSET, NO_ASSET, NO_ASSET, NO_ASSET] # 与设备端初始状态一致
+    keyframes, chapters = [], []
+    for i, line in enumerate(final_lines):
+        if i % interval == 0 or i in label_lines:
+            for label in label_lines.get(i, ()): chapters.append((label, len(keyframes)))
+            keyframes.append((i, tuple(state)))
+        fold_scene_state(state, line)
+    return keyframes, chapters
+
+def write_keyframes(path, final_lines, label_map_output, interval=KEYFRAME_INTERVAL):
+    keyframes, chapters = build_keyframes(final_lines, label_map_output, interval)
+    with open(path, 'wb') as f:
+        f.write(struct.pack(KEYFRAME_HEADER_FORMAT, KEYFRAME_MAGIC, KEYFRAME_VERSION, interval, len(keyframes), len(chapters)))
+        for line, state in keyframes:
+            f.write(struct.pack(KEYFRAME_RECORD_FORMAT, line, *state))
+        for label, keyframe_id in chapters:
+            name = label.encode('utf-8')[:KEYFRAME_NAME_SIZE].decode('utf-8', 'ignore').encode('utf-8')
+            f.write(struct.pack(KEYFRAME_CHAPTER_FORMAT, name, keyframe_id))
+    print(f"[第三步] 成功: 关键帧表已写入 '{path}' ({len(keyframes)} 个关键帧，{len(chapters)} 个章节)。")
+
+def pass_three_generate_final_script(script_lines, label_map_output, resolved_labels, asset_maps, output_filepath, layout="split", index_format="flat", source_name=None):
     print("[第三步] 正在生成最终脚本、索引和应用重索引...")
     final_lines_to_write = []
+    source_map = [] # 与 final_lines_to_write 一一对应: (输入行号, 所在标签)
+    current_label = None
     jump_pattern = re.compile(r'\[JUMP_TO_([^\]]+)\]', re.IGNORECASE)
     
     def replacer(match):
@@ -161,9 +362,13 @@ def pass_three_generate_final_script(script_lines, label_map_output, resolved_la
         final_label = resolved_labels.get(original_label, original_label)
         return str(label_map_output[final_label])
 
-    for line in script_lines:
+    for input_line_num, line in enumerate(script_lines, 1):
         stripped_line = line.strip()
-        if not stripped_line or stripped_line.upper().startswith(LABEL_PREFIX): continue
+        if not stripped_line: continue
+        if stripped_line.upper().startswith(LABEL_PREFIX):
+            label_parts = stripped_line.split()
+            if len(label_parts) > 1: current_label = label_parts[1]
+            continue
         
         processed_line = jump_pattern.sub(replacer, stripped_line)
         
@@ -174,8 +379,10 @@ def pass_three_generate_final_script(script_lines, label_map_output, resolved_la
                 paged_content = layout_dialogue(content)
                 for page in paged_content:
                     final_lines_to_write.append(f"{formatted_speaker}:{page}")
+                    source_map.append((input_line_num, current_label))
             except ValueError:
                 final_lines_to_write.append(processed_line)
+                source_map.append((input_line_num, current_label))
         else:
             parts = processed_line.split()
             command = parts[0].upper()
@@ -191,18 +398,34 @@ def pass_three_generate_final_script(script_lines, label_map_output, resolved_la
                 except Exception as e:
                     print(f"致命错误: 格式错误的 ^DATE 命令: {line} -> {e}"); sys.exit(1)
             final_lines_to_write.append(processed_line)
+            source_map.append((input_line_num, current_label))
 
     base_filepath = output_filepath.rsplit('.', 1)[0]
-    index_filepath = base_filepath + '.idx'
+    try:
+        write_source_map(base_filepath + SOURCE_MAP_SUFFIX, source_name, source_map)
+    except IOError as e:
+        print(f"警告: 无法写入源码映射: {e}")
+    try:
+        write_keyframes(base_filepath + '.kfr', final_lines_to_write, label_map_output)
+    except IOError as e:
+        print(f"致命错误: 无法写入关键帧表: {e}"); sys.exit(1)
+    index_filepath = base_filepath + ('.cdx' if index_format == "compact" else '.idx')
+    if layout == "sector":
+        try:
+            write_sector_aligned_script(final_lines_to_write, base_filepath + '.bin', index_format=index_format)
+        except IOError as e:
+            print(f"致命错误: 无法写入输出文件: {e}"); sys.exit(1)
+        return
     try:
         with open(output_filepath, 'w', encoding='utf-8', newline='\n') as txt_f, open(index_filepath, 'wb') as idx_f:
-            offset = 0
+            offset, offsets = 0, []
             for line in final_lines_to_write:
-                idx_f.write(struct.pack('<I', offset))
+                offsets.append(offset)
                 line_with_nl = line + '\n'
                 encoded_line = line_with_nl.encode('utf-8')
                 txt_f.write(line_with_nl)
                 offset += len(encoded_line)
+            idx_f.write(encode_index(offsets, index_format))
         print(f"[第三步] 成功: 脚本已写入 '{output_filepath}'。")
         print(f"[第三步] 成功: 索引已写入 '{index_filepath}'。")
     except IOError as e:
@@ -212,6 +435,12 @@ def main():
     parser = argparse.ArgumentParser(description="视觉小说脚本预处理器和资产管理器。")
     parser.add_argument("input_file", help="输入的原始脚本文件路径。")
     parser.add_argument("output_file", help="处理后输出的脚本文件路径 (例如 'final_script.txt')。")
+    parser.add_argument("--asset-order", choices=["first-use", "name"], default="first-use",
+                        help="资源索引分配方式: 按主线首次使用顺序 (默认) 或按名称排序。")
+    parser.add_argument("--layout", choices=["split", "sector"], default="split",
+                        help="输出布局: 脚本与 .idx 索引分开 (默认)，或输出扇区对齐、索引内嵌的单个 .bin 文件。")
+    parser.add_argument("--index", choices=["flat", "compact"], default="flat",
+                        help="索引格式: 每行 4 字节的平铺索引 (默认)，或差分编码的紧凑索引 (分离布局下输出 .cdx)。")
     args = parser.parse_args()
 
     try:
@@ -221,8 +450,20 @@ def main():
 
     label_map_output, label_map_input, bg_list, cg_list, bgm_list = pass_one_build_maps_and_collect_assets(script_lines)
     
+    # --- 资源排序: 让顺序游玩时对 bg.dat/cg.dat 的访问尽量向前推进 ---
+    route_uses = trace_main_route(script_lines, label_map_input)
+    name_bg_map = {name: i for i, name in enumerate(bg_list)}
+    name_cg_map = {name: i for i, name in enumerate(cg_list)}
+    if args.asset_order == "first-use":
+        bg_list = order_assets_by_first_use(script_lines, route_uses, 'bg', pinned_first=[TITLE_BG_NAME])
+        cg_list = order_assets_by_first_use(script_lines, route_uses, 'cg')
     bg_map = {name: i for i, name in enumerate(bg_list)}
     cg_map = {name: i for i, name in enumerate(cg_list)}
+    print(f"[资源排序] 主线共 {len(route_uses)} 次资源加载，索引距离分布:")
+    report_distance_histogram("BG 名称排序", route_uses, 'bg', name_bg_map)
+    report_distance_histogram("BG 当前排序", route_uses, 'bg', bg_map)
+    report_distance_histogram("CG 名称排序", route_uses, 'cg', name_cg_map)
+    report_distance_histogram("CG 当前排序", route_uses, 'cg', cg_map)
     
     manifest = {
         "bg_count": len(bg_list), "cg_count": len(cg_list),
@@ -238,7 +479,7 @@ def main():
         print(f"致命错误: 无法写入清单文件: {e}")
 
     resolved_labels = resolve_jump_chains(script_lines, label_map_input)
-    pass_three_generate_final_script(script_lines, label_map_output, resolved_labels, {"backgrounds": bg_map, "characters": cg_map}, args.output_file)
+    pass_three_generate_final_script(script_lines, label_map_output, resolved_labels, {"backgrounds": bg_map, "characters": cg_map}, args.output_file, args.layout, args.index, args.input_file)
     print("\n预处理成功完成！")
 
 if __name__ == "__main__":
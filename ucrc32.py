@@ -1,5 +1,19 @@
 # ucrc32.py
-def ucrc32(data, crc=0):
+# 描述: CRC-32 (IEEE 802.3，与 zlib / binascii.crc32 结果相同)。
+#       ucrc32() 按以下顺序选择实现: 固件自带的 binascii.crc32 (C 实现) >
+#       256 项查表的 viper 实现 > 纯 Python 查表 (在电脑上运行时)。
+#       crc32_bitwise 为原来的逐位实现，只作为 bench_crc32.py 的对照。
+from array import array
+try:
+    import micropython
+except ImportError:
+    micropython = None
+try:
+    from binascii import crc32 as crc32_native
+except ImportError:
+    crc32_native = None
+
+def crc32_bitwise(data, crc=0):
     crc ^= 0xffffffff
     for b in data:
         crc ^= b
@@ -8,4 +22,46 @@ def ucrc32(data, crc=0):
                 crc = (crc >> 1) ^ 0xEDB88320
             else:
                 crc >>= 1
-    return crc ^ 0xffffffff
\ No newline at end of file
+    return crc ^ 0xffffffff
+
+def _make_table():
+    table = array('I', [0] * 256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+        table[i] = crc
+    return table
+
+_TABLE = _make_table()
+
+def crc32_table(data, crc=0):
+    table = _TABLE
+    crc ^= 0xffffffff
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+crc32_viper = None
+if micropython:
+    @micropython.viper
+    def _crc32_viper_loop(data, length: int, crc: uint, table) -> uint:
+        d = ptr8(data); t = ptr32(table)
+        i = 0
+        while i < length:
+            crc = uint(t[int((crc ^ uint(d[i])) & 0xFF)]) ^ (crc >> 8)
+            i += 1
+        return crc
+
+    def crc32_viper(data, crc=0):
+        return _crc32_viper_loop(data, len(data), crc ^ 0xffffffff, _TABLE) ^ 0xffffffff
+
+if crc32_native:
+    IMPLEMENTATION = 'binascii'
+    ucrc32 = crc32_native
+elif crc32_viper:
+    IMPLEMENTATION = 'viper'
+    ucrc32 = crc32_viper
+else:
+    IMPLEMENTATION = 'table'
+    ucrc32 = crc32_table
@@ -84,9 +84,10 @@ class BMFont:
     def clear(d, f):
         d.fill(f)
 
-    def __init__(self, f):
+    def __init__(self, f, opener=None):
         self.font_file = f
-        self.font = open(f, "rb", buffering=0xff)
+        # opener 用于从资源包等非文件系统来源打开字体
+        self.font = opener(f, "rb") if opener else open(f, "rb", buffering=0xff)
         self.bmf_info = self.font.read(16)
         if self.bmf_info[0:2] != b"BM":
             raise TypeError("字体文件格式不正确: " + f)
@@ -0,0 +1,95 @@
+# utrace.py
+# 描述: 热路径埋点。提供三样东西，全部预分配、记录时不分配内存:
+#   1. 分级日志 log(): 运行时按 level 过滤。热路径上的调用方应再包一层模块内的
+#      const 开关 (如 engine.py 的 `if _TRACE_DEBUG:`)，关闭时连同字符串格式化一起在编译期消失。
+#   2. 环形事件缓冲 event(): 只记录 (时间戳, 事件, 参数) 三个整数，保留最近 _EVENTS 条。
+#   3. 分子系统耗时直方图 begin()/end(): 按 2 的幂分桶 (桶 b 覆盖 [2^b, 2^(b+1)) 微秒)。
+#   dump() 把直方图和最近的事件打印出来，只在需要时调用，不会干扰被测的帧。
+import time
+from array import array
+from micropython import const
+
+# --- 日志等级 ---
+LOG_OFF = const(0)
+LOG_ERROR = const(1)
+LOG_INFO = const(2)
+LOG_DEBUG = const(3)
+level = LOG_INFO
+
+# --- 子系统 ---
+SPAN_INPUT = const(0)
+SPAN_STEP = const(1)
+SPAN_RENDER = const(2)
+SPAN_FLUSH = const(3)
+SPAN_AUDIO = const(4)
+SPAN_GC = const(5)
+_SPAN_NAMES = ('input', 'step', 'render', 'flush', 'audio', 'gc')
+_SPANS = const(6)
+_BUCKETS = const(16)
+
+# --- 事件 ---
+EV_STEP = const(1)   # 参数: 执行的脚本行 (PC)
+EV_WAIT = const(2)   # 参数: 进入的等待模式
+EV_READ = const(3)   # 参数: 脚本预读窗口重新填充的文件偏移
+EV_SCENE = const(4)  # 参数: 重新合成场景的背景索引
+_EVENT_NAMES = ('-', 'step', 'wait', 'read', 'scene')
+_EVENTS = const(64)
+
+_events = array('I', [0] * (3 * _EVENTS))
+_head = 0
+_event_count = 0
+_hist = array('I', [0] * (_SPANS * _BUCKETS))
+_span_count = array('I', [0] * _SPANS)
+_span_total = array('I', [0] * _SPANS) # 微秒累计；超过 2^30 后在设备上会变成堆上的大整数，长时间采样前先 reset()
+_span_max = array('I', [0] * _SPANS)
+
+def log(lvl, msg):
+    if lvl <= level: print(msg)
+
+def event(ev, arg=0):
+    global _head, _event_count
+    i = 3 * _head
+    _events[i] = time.ticks_us()
+    _events[i + 1] = ev
+    _events[i + 2] = arg
+    _head = (_head + 1) % _EVENTS
+    _event_count += 1
+
+def begin():
+    return time.ticks_us()
+
+def end(span, start):
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    if elapsed < 0: elapsed = 0
+    bucket, v = 0, elapsed
+    while v > 1 and bucket < _BUCKETS - 1:
+        v >>= 1; bucket += 1
+    _hist[span * _BUCKETS + bucket] += 1
+    _span_count[span] += 1
+    _span_total[span] += elapsed
+    if elapsed > _span_max[span]: _span_max[span] = elapsed
+
+def reset():
+    global _head, _event_count
+    _head = 0
+    _event_count = 0
+    for arr in (_events, _hist, _span_count, _span_total, _span_max):
+        for i in range(len(arr)): arr[i] = 0
+
+def dump():
+    print("--- 耗时直方图 (微秒，桶: 下限=次数) ---")
+    for span in range(_SPANS):
+        count = _span_count[span]
+        if not count: continue
+        base = span * _BUCKETS
+        buckets = ' '.join(f"{1 << b}={_hist[base + b]}" for b in range(_BUCKETS) if _hist[base + b])
+        print(f"  {_SPAN_NAMES[span]:<6} {count} 次，平均 {_span_total[span] // count} us，最长 {_span_max[span]} us | {buckets}")
+    n = min(_event_count, _EVENTS)
+    print(f"--- 最近 {n} 个事件 (共 {_event_count} 个) ---")
+    first = (_head - n) % _EVENTS
+    origin = _events[3 * first]
+    for k in range(n):
+        i = 3 * ((first + k) % _EVENTS)
+        ev = _events[i + 1]
+        name = _EVENT_NAMES[ev] if ev < len(_EVENT_NAMES) else str(ev)
+        print(f"  +{time.ticks_diff(_events[i], origin):>9} us  {name:<5} {_events[i + 2]}")